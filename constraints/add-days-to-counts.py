@@ -1,59 +1,191 @@
 #!/usr/bin/env python
 
 """
-Adds a "day" column to a counts file, given as the only
-command-line parameter. 
+Adds a "day" column to a counts file, given as the first
+command-line parameter.
 
-Also writes a backup ".bak" file just in case.
+Each row is repeated once for every day in its month, and the output
+is written to "<counts_file>.days".
+
+The input is read (and the output written) in chunks of `CHUNK_SIZE`
+rows, so memory use does not depend on the size of the file. Each input row
+becomes up to 31 output rows, so a chunk holds about 30 times as many rows
+once expanded: keep `--chunk-size` small.
+
+With `--format parquet` (or `feather`) the output is written as a columnar
+file instead: "<counts_file>.days.parquet" (or ".days.feather"). Every column
+except "count" is dictionary-encoded, and "count" is stored as an integer.
+`minimise-constraints.py` reads these files directly. This needs `pyarrow`.
 """
 
-import shutil
-import sys
+import argparse
 import calendar
 
+import numpy as np
 import pandas as pd
 
 
+CHUNK_SIZE = 5000
+
+DAY_LABELS = np.array([f'{day:02d}' for day in range(32)])
+
+
+def parse_counts(counts_file, chunksize=CHUNK_SIZE):
+    "Returns an iterator over chunks of the counts file (as DataFrames of strings)."
+    return pd.read_csv(counts_file, dtype=str, skipinitialspace=True, chunksize=chunksize)
+
+
+def days_in_months(years, months):
+    """Returns an array of the number of days in each (year, month) pair.
+
+    The number is only looked up once for each distinct pair.
+    """
+    year_months = years.astype(np.int64) * 100 + months.astype(np.int64)
+    unique, inverse = np.unique(year_months, return_inverse=True)
+
+    n_days = np.array([calendar.monthrange(ym // 100, ym % 100)[1] for ym in unique.tolist()],
+                      dtype=np.int64)
+    return n_days[inverse]
+
+
+def expand_chunk(df, columns):
+    "Returns `df` with each row repeated for every day of its month, with a 'day' column."
+    n_days = days_in_months(df['year'].to_numpy(), df['month'].to_numpy())
+
+    # Day numbers count up from 1 within each repeated row
+    starts = np.repeat(np.cumsum(n_days) - n_days, n_days)
+    days = np.arange(starts.size) - starts + 1
+
+    expanded = dict([(column, np.repeat(df[column].to_numpy(), n_days))
+                     for column in df.columns])
+    expanded['day'] = DAY_LABELS[days]
+
+    return pd.DataFrame(expanded, columns=columns)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception('The "pyarrow" package is required to write parquet/feather files')
+
+    return pyarrow
+
+
+def to_record_batch(chunk, categories):
+    """Converts `chunk` to a pyarrow RecordBatch, with every column except "count"
+    dictionary-encoded.
+
+    `categories` holds the codes used so far for each column. New values are
+    appended, so codes stay the same across chunks and each dictionary only grows.
+    """
+    pa = _import_pyarrow()
+    arrays = []
+
+    for column in chunk.columns:
+        values = chunk[column].to_numpy()
 
-def parse_counts(counts_file): 
-    df = pd.read_csv(counts_file, dtype=str, skipinitialspace=True)
-    return df
+        if column == 'count':
+            arrays.append(pa.array(values.astype(np.int64)))
+            continue
 
+        known = categories.setdefault(column, {})
+        unique, inverse = np.unique(values.astype(str), return_inverse=True)
+        codes = np.array([known.setdefault(value, len(known)) for value in unique.tolist()],
+                         dtype=np.int32)
 
-def main(counts_file=sys.argv[1]):
+        arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes[inverse], type=pa.int32()),
+                                                     pa.array(list(known), type=pa.string())))
 
-    df = parse_counts(counts_file)
-    columns = list(df.columns)
-    columns.insert(-1, 'day')
+    return pa.record_batch(arrays, names=list(chunk.columns))
+
+
+class ColumnarWriter(object):
+    "Writes chunks to a parquet or feather (Arrow IPC) file, one record batch at a time."
+
+    def __init__(self, fpath, fmt):
+        self.fpath = fpath
+        self.fmt = fmt
+        self.categories = {}
+        self._writer = None
+
+    def write(self, chunk):
+        pa = _import_pyarrow()
+        batch = to_record_batch(chunk, self.categories)
+
+        if not self._writer:
+            if self.fmt == 'parquet':
+                self._writer = pa.parquet.ParquetWriter(self.fpath, batch.schema)
+            else:
+                # Dictionaries grow between batches, which is written as a delta
+                options = pa.ipc.IpcWriteOptions(compression='lz4', emit_dictionary_deltas=True)
+                self._writer = pa.ipc.new_file(self.fpath, batch.schema, options=options)
+
+        if self.fmt == 'parquet':
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+
+
+def output_path(counts_file, fmt):
+    if fmt == 'csv':
+        return f'{counts_file}.days'
+
+    return f'{counts_file}.days.{fmt}'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('counts_file', help='Counts file')
+    parser.add_argument('-f', '--format', choices=['csv', 'parquet', 'feather'], default='csv',
+                        help='Output format')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='Number of input rows processed at a time')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+    counts_file = args.counts_file
+    counts_new = output_path(counts_file, args.format)
+
+    columnar = None if args.format == 'csv' else ColumnarWriter(counts_new, args.format)
 
-    data = []
     header = True
     mode = 'w'
+    n_in = n_out = 0
 
-    counts_new = f'{counts_file}.days'
+    for df in parse_counts(counts_file, chunksize=args.chunk_size):
+        columns = list(df.columns)
+        columns.insert(-1, 'day')
 
-    for _, row in df.iterrows():
+        chunk = expand_chunk(df, columns)
 
-        if _ > 0 and _ % 1000 == 0: 
-            print(f'Progress: {_} out of {len(df)}')
+        if columnar:
+            columnar.write(chunk)
+        else:
+            chunk.to_csv(counts_new, columns=columns, mode=mode, header=header, index=False)
 
-        n_days = calendar.monthrange(int(row.year), int(row.month))[1]
-         
-        for i in range(1, n_days + 1):
-            _row = row.copy()         
-            _row['day'] = f'{i:02d}'
-            data.append(_row)
+        header = False
+        mode = 'a'
 
-        if len(data) > 10000:
-            chunk = pd.DataFrame(data=data, columns=columns) 
-            chunk.to_csv(counts_new, columns=columns, mode=mode, header=header, index=False)
-            header = False
+        n_in += len(df)
+        n_out += len(chunk)
+        print(f'Wrote {n_out} records so far (from {n_in} input records)...')
+
+    if columnar:
+        columnar.close()
 
-            mode = 'a'
-            print(f'Wrote {len(chunk)} records so far...')
-            data = []
-                
-    print(f'Wrote: {counts_new}') 
+    print(f'Wrote: {counts_new}')
 
 
 if __name__ == '__main__':
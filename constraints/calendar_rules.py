@@ -0,0 +1,164 @@
+"""
+Calendar rules for constraints.
+
+A constraint over years and months (with no "day" key) is taken to mean:
+"all valid days in these years/months". This keeps the day dimension out of
+the minimisation, and the days are only filled in when the CDS constraints
+are written out.
+
+Expanding a constraint splits it into (at most) one constraint per
+month-length class:
+
+    28 days: 02                          - years that are not leap years
+    29 days: 02                          - leap years
+    30 days: 04 06 09 11                 - all years
+    31 days: 01 03 05 07 08 10 12        - all years
+
+Leap years follow the Gregorian rules, so 1800 and 1900 are not leap years.
+
+Which time dimensions a constraint gets depends on its "frequency":
+
+ monthly   --> no days or hours
+ daily     --> days
+ sub_daily --> days and hours
+ (none)    --> days and hours (e.g. marine constraints)
+
+A constraint holding more than one frequency is split by frequency first
+(see `split_by_frequency`).
+"""
+
+import calendar
+
+
+MONTHS_BY_LENGTH = {
+    30: ['04', '06', '09', '11'],
+    31: ['01', '03', '05', '07', '08', '10', '12']
+}
+
+FEBRUARY = '02'
+
+# The time dimensions added for each frequency: (add days, add hours)
+TIME_DIMENSIONS = {
+    'monthly': (False, False),
+    'daily': (True, False),
+    'sub_daily': (True, True)
+}
+
+NO_FREQUENCY = (True, True)
+
+# Day lists are built once and shared between all expanded constraints
+DAYS = dict([(n_days, [f'{day:02d}' for day in range(1, n_days + 1)])
+             for n_days in range(28, 32)])
+
+
+def split_february_years(years):
+    """Splits `years` into those where February has 28 days and those where
+    it has 29 days.
+
+    Returns:
+        tuple: (years_28, years_29) - two lists of years, in their original order
+    """
+    years_28, years_29 = [], []
+
+    for year in years:
+        if calendar.isleap(int(year)):
+            years_29.append(year)
+        else:
+            years_28.append(year)
+
+    return years_28, years_29
+
+
+def month_length_classes(years, months):
+    """Groups `years` and `months` by the number of days in the month.
+
+    If `years` is None, February is taken to have 28 days.
+
+    Yields:
+        tuple: (years, months, n_days) - in order of increasing `n_days`
+    """
+    months = set(months)
+
+    if FEBRUARY in months:
+        if years is None:
+            yield years, [FEBRUARY], 28
+        else:
+            for n_days, feb_years in zip((28, 29), split_february_years(years)):
+                if feb_years:
+                    yield feb_years, [FEBRUARY], n_days
+
+    for n_days in sorted(MONTHS_BY_LENGTH):
+        picked = [month for month in MONTHS_BY_LENGTH[n_days] if month in months]
+
+        if picked:
+            yield years, picked, n_days
+
+
+def split_by_frequency(con):
+    """Splits constraint `con` by the time dimensions its frequencies need.
+
+    Yields:
+        tuple: (constraint, add_days, add_hours)
+    """
+    if 'frequency' not in con:
+        yield (con,) + NO_FREQUENCY
+        return
+
+    groups = {}
+
+    for freq in con['frequency']:
+        if freq not in TIME_DIMENSIONS:
+            raise Exception(f'Unknown frequency "{freq}" in constraint: {con}')
+
+        groups.setdefault(TIME_DIMENSIONS[freq], []).append(freq)
+
+    if len(groups) == 1:
+        yield (con,) + TIME_DIMENSIONS[con['frequency'][0]]
+        return
+
+    for dims, freqs in groups.items():
+        dout = dict(con)
+        dout['frequency'] = freqs
+        yield (dout,) + dims
+
+
+def expand_constraint(con):
+    """Expands the calendar rule in constraint `con` into constraints with
+    explicit "day" lists. The other values are shared with `con`, not copied.
+
+    Yields:
+        dict: a constraint with "year", "month" and "day" lists
+    """
+    if 'day' in con:
+        raise Exception(f'Cannot apply a calendar rule to a constraint that already has a "day": {con}')
+
+    if 'month' not in con:
+        raise Exception(f'Cannot apply a calendar rule to a constraint with no "month": {con}')
+
+    for years, months, n_days in month_length_classes(con.get('year'), con['month']):
+        dout = dict(con)
+
+        if years is not None:
+            dout['year'] = years
+
+        dout['month'] = months
+        dout['day'] = DAYS[n_days]
+
+        yield dout
+
+
+def expand_constraints(constraints):
+    """Yields the expanded constraints for each constraint in `constraints` (see
+    `expand_constraint`). Only frequencies that need days are expanded, so
+    monthly constraints are yielded as they are.
+    """
+    for con in constraints:
+        for dout, add_days, _ in split_by_frequency(con):
+            if add_days:
+                yield from expand_constraint(dout)
+            else:
+                yield dout
+
+
+assert (['1897', '1900'], ['1896']) == split_february_years(['1896', '1897', '1900'])
+assert (['1800', '1900', '1901'], ['2000']) == split_february_years(['1800', '1900', '1901', '2000'])
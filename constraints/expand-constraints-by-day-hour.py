@@ -16,32 +16,84 @@ Needs to use sets:
    years(1800 and 1900 AND all except divisible by 4) --> days(1,28) --> hours(0, 23)
    years(divisible by 4 excluding 1800 and 1900) --> days(1,29) --> hours(0, 23)
  months = 4,6,9,11 --> all years --> days(1, 30) --> hours(0, 23)
- 
+
+Which time dimensions are added depends on the "frequency" of each constraint
+(see `calendar_rules.TIME_DIMENSIONS`). A constraint holding more than one
+frequency is split by frequency first. Constraints that already have a "day" (or "hour") are not expanded again.
+
+The constraints are read, expanded and written one at a time (generators all
+the way through), so memory use does not depend on the size of the output.
 """
 
-import calendar as cal
+import argparse
 
+import calendar_rules
+import json_stream
 
-d31_months = ['01', '03', '05', '07', '08', '10', '12']
-d30_months = ['04', '06', '09', '11']
 
-irregular_leap_years = [1800, 1900]
+HOURS = [f'{hour:02d}' for hour in range(24)]
 
 
 def get_feb_years_by_length(length, years):
-    years = [int(_) for _ in years]
+    years_28, years_29 = calendar_rules.split_february_years(years)
+    res = years_28 if length == 28 else years_29
+
+    return sorted([str(_) for _ in res])
 
-    if length == 28:
-        res = set([_ for _ in years if _ % 4 != 0])
-        for yr in irregular_leap_years:
-            if yr in years:
-                res.add(yr)
 
-    elif length == 29:
-        res = [_ for _ in years if _ % 4 == 0 and _ not in irregular_leap_years]
+def expand_constraint(con, hours=True):
+    """Expands constraint `con` by day and hour, as its frequency requires.
+
+    Yields:
+        dict: expanded constraints (sharing unchanged values with `con`)
+    """
+    for dout, add_days, add_hours in calendar_rules.split_by_frequency(con):
+
+        if add_days and 'day' not in dout:
+            expanded = calendar_rules.expand_constraint(dout)
+        else:
+            expanded = [dout]
+
+        for dexp in expanded:
+            if hours and add_hours and 'hour' not in dexp:
+                dexp = dict(dexp)
+                dexp['hour'] = HOURS
+
+            yield dexp
+
+
+def expand_constraints(constraints, hours=True):
+    "Yields the expanded constraints for each constraint in `constraints`."
+    for con in constraints:
+        yield from expand_constraint(con, hours=hours)
 
-    return sorted([str(_) for _ in res])
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-i', '--input-file', required=True, help='Input JSON constraints file')
+    parser.add_argument('-o', '--output-file', required=True, help='Output JSON constraints file')
+    parser.add_argument('--no-hours', action='store_true',
+                        help='Only expand by day (do not add "hour" lists)')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    with open(args.input_file) as reader, open(args.output_file, 'w') as writer:
+        constraints = json_stream.iter_json_array(reader)
+        n = json_stream.write_json_array(writer, expand_constraints(constraints, hours=not args.no_hours))
+
+    print(f'[INFO] Wrote {n} constraints to: {args.output_file}')
 
 
 assert(['1896'] == get_feb_years_by_length(29, ['1896', '1897', '1898', '1899', '1900']))
 assert(['1900', '1901'] == get_feb_years_by_length(28, ['1900', '1901']))
+
+
+if __name__ == '__main__':
+
+    main()
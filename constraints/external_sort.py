@@ -0,0 +1,266 @@
+"""
+Out-of-core records, for inputs that do not fit in memory (see `record_matrix.py`).
+
+With a memory budget, the counts file is read with a `SpillingRecordBuilder`:
+whenever the rows encoded so far fill a run, the run of `int32` codes is
+spilled to a `.npy` file in a temporary directory. The result is a
+`SpilledRecords`, which only keeps the code tables in memory and answers what
+the minimiser asks of a `RecordMatrix` by streaming the runs back:
+
+ - `count_distinct(keys)`: the codes of `keys` in each run are combined into
+   one int64 per row (in mixed radix), sorted, de-duplicated and spilled. The
+   sorted runs are then merged (`merge_distinct`) and the keys counted
+ - `iter_sorted_keys(key_order)`: the same merge, yielding the sorted keys in
+   blocks, from which the constraints are generated in order
+
+Only one run (while spilling and sorting) or one block per run (while merging)
+is held in memory at a time.
+"""
+
+from array import array
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import stats
+from record_matrix import CODE_DTYPE, RecordMatrixBuilder, as_value_set, distinct_sorted
+
+
+# Default memory budget, in bytes
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+# The combined int64 keys must not overflow
+MAX_COMBINATIONS = 2 ** 62
+
+# Bytes of memory per byte of counts text while parsing (rows of strings)
+PARSE_OVERHEAD = 32
+
+
+def run_rows(memory_budget, n_columns):
+    """Returns the number of rows in each spilled run: a run is loaded with its
+    remapped codes, their int64 keys and a sorted copy of those.
+    """
+    row_bytes = 2 * n_columns * np.dtype(CODE_DTYPE).itemsize + 3 * 8
+    return max(1, memory_budget // row_bytes)
+
+
+def block_rows(memory_budget, n_runs):
+    """Returns the number of keys read from each run at a time while merging.
+
+    A merged block holds up to one block per run, with a sorted copy, and is
+    turned into lists of Python ints when generating constraints.
+    """
+    return max(1024, memory_budget // (64 * max(1, n_runs)))
+
+
+def read_chunk_size(memory_budget):
+    "Returns the number of bytes of a counts file to read at a time."
+    return max(64 * 1024, memory_budget // PARSE_OVERHEAD)
+
+
+def merge_distinct(paths, n_rows):
+    """Merges runs of sorted, distinct int64 keys (`.npy` files), yielding the
+    distinct keys of all the runs in sorted order, in blocks.
+
+    `n_rows` keys are read from each run at a time. Every key up to the
+    smallest last key read from a run with more to read can then be yielded:
+    any key still to be read is larger.
+    """
+    runs = [np.load(path, mmap_mode='r') for path in paths]
+    positions = [0] * len(runs)
+    buffers = [np.empty(0, dtype=np.int64) for _ in runs]
+
+    while True:
+        for i, run in enumerate(runs):
+            if buffers[i].size == 0 and positions[i] < len(run):
+                buffers[i] = np.array(run[positions[i]:positions[i] + n_rows])
+                positions[i] += buffers[i].size
+
+        active = [i for i, buffer in enumerate(buffers) if buffer.size]
+
+        if not active:
+            return
+
+        limits = [buffers[i][-1] for i in active if positions[i] < len(runs[i])]
+        bound = min(limits) if limits else None
+        parts = []
+
+        for i in active:
+            n = buffers[i].size if bound is None else np.searchsorted(buffers[i], bound, side='right')
+            parts.append(buffers[i][:n])
+            buffers[i] = buffers[i][n:]
+
+        yield distinct_sorted(np.concatenate(parts))
+
+
+class SpillingRecordBuilder(RecordMatrixBuilder):
+    """Builds `SpilledRecords`: the same as a `RecordMatrixBuilder`, except that
+    the codes are spilled to disk in runs (of provisional codes, renumbered into
+    sorted order as the runs are read back).
+    """
+
+    def __init__(self, columns, memory_budget=MEMORY_BUDGET, tmp_dir=None):
+        super().__init__(columns)
+        self.memory_budget = memory_budget
+        self.run_rows = run_rows(memory_budget, len(self.columns))
+        self.spill_dir = tempfile.mkdtemp(prefix='constraints-spill-', dir=tmp_dir)
+        self.runs = []
+        self.n_spilled = 0
+
+    def __len__(self):
+        return self.n_spilled + super().__len__()
+
+    def extend(self, rows):
+        super().extend(rows)
+        self._spill_full_run()
+
+    def extend_encoded(self, i, values, indices):
+        super().extend_encoded(i, values, indices)
+        self._spill_full_run()
+
+    def _spill_full_run(self):
+        # Columnar batches are added one column at a time: only spill once
+        # every column holds the same rows
+        sizes = set([len(codes) for codes in self._codes])
+
+        if len(sizes) == 1 and sizes.pop() >= self.run_rows:
+            self._spill()
+
+    def _spill(self):
+        n = len(self._codes[0])
+
+        if not n:
+            return
+
+        run = np.empty((n, len(self.columns)), dtype=CODE_DTYPE)
+
+        for i, codes in enumerate(self._codes):
+            run[:, i] = np.frombuffer(codes, dtype=CODE_DTYPE)
+            self._codes[i] = array('i')
+
+        path = os.path.join(self.spill_dir, f'records-{len(self.runs):05d}.npy')
+        np.save(path, run)
+
+        self.runs.append(path)
+        self.n_spilled += n
+
+    def build(self):
+        self._spill()
+        tables, remaps = self.sorted_tables()
+
+        stats.count('spill_runs', len(self.runs))
+        return SpilledRecords(self.columns, tables, remaps, self.runs, self.n_spilled,
+                              self.spill_dir, self.memory_budget)
+
+
+class SpilledRecords(object):
+
+    def __init__(self, columns, tables, remaps, runs, n_records, spill_dir, memory_budget=MEMORY_BUDGET):
+        """
+        Args:
+            columns (list): a list of keys
+            tables (list): one sorted list of values per column
+            remaps (list): one array per column, mapping the codes in the runs onto `tables`
+            runs (list): the `.npy` files of (n_rows, n_columns) codes
+            n_records (int): the total number of rows in the runs
+            spill_dir (str): the directory holding the runs (removed by `close`)
+            memory_budget (int): approximate number of bytes to use at a time
+        """
+        self.columns = list(columns)
+        self.tables = tables
+        self.remaps = remaps
+        self.runs = runs
+        self.n_records = n_records
+        self.spill_dir = spill_dir
+        self.memory_budget = memory_budget
+
+    def __len__(self):
+        return self.n_records
+
+    def indexes(self, keys):
+        return [self.columns.index(key) for key in keys]
+
+    def cardinality(self, key):
+        return len(self.tables[self.columns.index(key)])
+
+    def value_sets(self, key):
+        "Returns the code table for column `key` with every value as a frozenset."
+        return [as_value_set(value) for value in self.tables[self.columns.index(key)]]
+
+    def iter_runs(self, keys):
+        "Yields the codes of `keys` in each run, as (n_rows, len(keys)) arrays."
+        indexes = self.indexes(keys)
+
+        for path in self.runs:
+            run = np.load(path, mmap_mode='r')
+            yield np.column_stack([self.remaps[i][run[:, i]] for i in indexes])
+
+    def iter_sorted_keys(self, keys):
+        """Yields the distinct combinations of `keys` across the records, in
+        sorted order, as blocks (int64 arrays) of combined keys. A combined key
+        holds the codes in mixed radix, with the first key the most significant
+        (see `decode_key`).
+        """
+        sizes = [self.cardinality(key) for key in keys]
+
+        if np.prod(sizes, dtype=float) >= MAX_COMBINATIONS:
+            raise Exception(f'Too many combinations of {list(keys)} to sort on disk')
+
+        sort_dir = tempfile.mkdtemp(prefix='sort-', dir=self.spill_dir)
+
+        try:
+            paths = []
+
+            for codes in self.iter_runs(keys):
+                combined = np.zeros(len(codes), dtype=np.int64)
+
+                for i, size in enumerate(sizes):
+                    combined *= size
+                    combined += codes[:, i]
+
+                path = os.path.join(sort_dir, f'keys-{len(paths):05d}.npy')
+                np.save(path, distinct_sorted(combined))
+                paths.append(path)
+
+                del codes, combined
+
+            yield from merge_distinct(paths, block_rows(self.memory_budget, len(paths)))
+        finally:
+            shutil.rmtree(sort_dir, ignore_errors=True)
+
+    def decode_key(self, key, keys):
+        "Returns the codes of `keys` held in combined `key` (see `iter_sorted_keys`)."
+        codes = []
+
+        for size in reversed([self.cardinality(k) for k in keys]):
+            key, code = divmod(key, size)
+            codes.append(code)
+
+        return codes[::-1]
+
+    def count_distinct(self, keys):
+        "Returns the number of distinct combinations of `keys` across the records."
+        if len(self) == 0:
+            return 0
+
+        if not keys:
+            return 1
+
+        return sum([block.size for block in self.iter_sorted_keys(list(keys))])
+
+    def to_records(self):
+        "Returns the records as a list of dictionaries of {key: frozenset}."
+        sets = [self.value_sets(key) for key in self.columns]
+        records = []
+
+        for codes in self.iter_runs(self.columns):
+            records.extend([dict([(key, sets[i][code]) for i, (key, code) in enumerate(zip(self.columns, row))])
+                            for row in codes.tolist()])
+
+        return records
+
+    def close(self):
+        "Removes the spilled runs."
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
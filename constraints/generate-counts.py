@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+Writes a synthetic counts file with the same layout as the database counts, e.g.:
+
+    domain,report_type,variable,data_policy_licence,quality_flag,year,month,count
+    land,2,44,0,0,1761,01,0
+
+Each (report_type, variable) series starts in a random year (and sometimes
+stops early). Within a series, whole years and single months are given a zero
+count at a rate set by `--sparsity`. With `--days` a "day" column is added
+(before "count"), as `add-days-to-counts.py` would.
+
+Rows are written as they are generated, so any size of file can be produced.
+"""
+
+import argparse
+import calendar
+import random
+
+
+VARIABLES = {
+    'land': ['36', '44', '45', '53', '55', '57', '58', '85', '106', '107'],
+    'marine': ['36', '58', '85', '95', '106', '107']
+}
+
+
+def get_variables(domain, n_variables):
+    "Returns `n_variables` variable codes, inventing extra codes if needed."
+    variables = VARIABLES[domain][:n_variables]
+    extra = n_variables - len(variables)
+
+    return variables + [str(1000 + i) for i in range(extra)]
+
+
+def generate_rows(domain='land', n_variables=10, n_report_types=2, n_licences=2,
+                  n_quality_flags=2, start_year=1761, end_year=2018, sparsity=0.2,
+                  days=False, seed=0):
+    """Generates the rows of a counts file (as lists of strings), header first.
+
+    Args:
+        sparsity (float): approximate fraction of rows with a zero count
+
+    Returns:
+        generator of lists
+    """
+    rng = random.Random(seed)
+    columns = ['domain', 'report_type', 'variable', 'data_policy_licence',
+               'quality_flag', 'year', 'month'] + (['day'] if days else []) + ['count']
+    yield columns
+
+    span = end_year - start_year + 1
+
+    for report_type in [str(i + 1) for i in range(n_report_types)]:
+        for variable in get_variables(domain, n_variables):
+
+            # Series start at different times, and some stop early
+            first = start_year + rng.randrange(max(1, span // 2))
+            last = end_year if rng.random() > 0.1 else rng.randint(first, end_year)
+
+            for licence in [str(i) for i in range(n_licences)]:
+                for flag in [str(i) for i in range(n_quality_flags)]:
+                    for year in range(first, last + 1):
+                        empty_year = rng.random() < sparsity / 2
+
+                        for month in range(1, 13):
+                            n_days = calendar.monthrange(year, month)[1] if days else 1
+
+                            for day in range(1, n_days + 1):
+                                if empty_year or rng.random() < sparsity / 2:
+                                    count = 0
+                                else:
+                                    count = rng.randint(1, 5000)
+
+                                row = [domain, report_type, variable, licence, flag,
+                                       str(year), f'{month:02d}']
+                                if days:
+                                    row.append(f'{day:02d}')
+
+                                row.append(str(count))
+                                yield row
+
+
+def write_counts(output_file, **kwargs):
+    "Writes a counts file generated by `generate_rows(**kwargs)`. Returns the number of records."
+    n_rows = -1
+
+    with open(output_file, 'w') as writer:
+        for row in generate_rows(**kwargs):
+            writer.write(','.join(row) + '\n')
+            n_rows += 1
+
+    return n_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--domain', choices=sorted(VARIABLES), default='land',
+                        help='Domain (sets the variable codes used)')
+    parser.add_argument('-n', '--variables', type=int, default=10, help='Number of variables')
+    parser.add_argument('-r', '--report-types', type=int, default=2, help='Number of report types')
+    parser.add_argument('-l', '--licences', type=int, default=2, help='Number of licences')
+    parser.add_argument('-q', '--quality-flags', type=int, default=2, help='Number of quality flags')
+    parser.add_argument('--start-year', type=int, default=1761, help='First year')
+    parser.add_argument('--end-year', type=int, default=2018, help='Last year')
+    parser.add_argument('--sparsity', type=float, default=0.2,
+                        help='Approximate fraction of zero-count rows')
+    parser.add_argument('--days', action='store_true', help='Add a "day" column')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('-o', '--output-file', required=True, help='Output file')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    n_rows = write_counts(args.output_file, domain=args.domain, n_variables=args.variables,
+                          n_report_types=args.report_types, n_licences=args.licences,
+                          n_quality_flags=args.quality_flags, start_year=args.start_year,
+                          end_year=args.end_year, sparsity=args.sparsity, days=args.days,
+                          seed=args.seed)
+
+    print(f'[INFO] Wrote {n_rows} records to: {args.output_file}')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,130 @@
+"""
+Incremental reading and writing of JSON arrays (such as `constraints.json`),
+so that the whole array never has to be held in memory.
+"""
+
+import json
+
+
+# Number of characters read from a file at a time
+CHUNK_SIZE = 1024 * 1024
+
+
+def _check_end(rest, reader, chunk_size):
+    "Raises ValueError if anything but whitespace follows the end of an array."
+    while True:
+        if rest.strip():
+            raise ValueError(f'Extra data after JSON array: {rest.strip()[:100]!r}')
+
+        rest = reader.read(chunk_size)
+
+        if not rest:
+            return
+
+
+def iter_json_array(reader, chunk_size=CHUNK_SIZE):
+    """Yields the items of the JSON array in file object `reader`, one at a time,
+    reading `chunk_size` characters at a time.
+
+    Raises:
+        ValueError: if the file does not hold a (complete) JSON array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    # What comes next: '[', an item or ']' (after '['), an item (after ','),
+    # or ',' or ']' (after an item)
+    expect = 'start'
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Unexpected end of JSON array')
+
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+
+            buffer = chunk
+            pos = 0
+            continue
+
+        char = buffer[pos]
+
+        if expect == 'start':
+            if char != '[':
+                raise ValueError('Expected a JSON array')
+
+            pos += 1
+            expect = 'first'
+            continue
+
+        if expect == 'separator':
+            if char == ']':
+                _check_end(buffer[pos + 1:], reader, chunk_size)
+                return
+
+            if char != ',':
+                raise ValueError(f'Expected "," or "]" near: {buffer[pos:pos + 100]!r}')
+
+            pos += 1
+            expect = 'item'
+            continue
+
+        if expect == 'first' and char == ']':
+            _check_end(buffer[pos + 1:], reader, chunk_size)
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            item, end = None, None
+
+        # An item must be followed by a separator (or the end of the file), so that a
+        # number cut off in the buffer (e.g. "2." of "2.5") is not taken as complete
+        if end is not None and (buffer[end:end + 1] in (',', ']') or buffer[end:end + 1].isspace()
+                                or (eof and end == len(buffer))):
+            yield item
+            pos = end
+            expect = 'separator'
+            continue
+
+        if eof:
+            raise ValueError(f'Invalid JSON array near: {buffer[pos:pos + 100]!r}')
+
+        chunk = reader.read(chunk_size)
+        eof = not chunk
+
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def write_json_array(writer, items, indent=4):
+    """Writes `items` to file object `writer` as a JSON array, one item at a time.
+
+    The output is the same as `json.dump(list(items), writer, indent=indent)`.
+
+    Returns:
+        int: the number of items written
+    """
+    count = 0
+    prefix = ' ' * indent if indent else ''
+    separator = ',\n' if indent else ', '
+
+    writer.write('[')
+
+    for item in items:
+        text = json.dumps(item, indent=indent)
+
+        if indent:
+            text = '\n'.join([prefix + line for line in text.split('\n')])
+
+        writer.write((separator if count else ('\n' if indent else '')) + text)
+        count += 1
+
+    writer.write(('\n]' if indent and count else ']'))
+    return count
@@ -0,0 +1,142 @@
+"""
+Search strategies for choosing the key order passed to `generate_constraints()`.
+
+`generate_constraints()` sorts the records by the key order and merges
+consecutive records that share the same values for all but the last key.
+The number of constraints it returns is therefore the number of distinct
+combinations of the leading keys - whatever order those leading keys are in.
+
+Two things follow from that:
+
+ - only the choice of the last key changes the constraint count
+ - the distinct count over any subset of the leading keys is a lower bound
+   on the final count, and it can only grow as more keys are added
+
+The heuristic search uses both to avoid evaluating every permutation.
+"""
+
+import stats
+
+
+def count_distinct(keys, records):
+    "Returns the number of distinct combinations of `keys` across `records` (a `RecordMatrix`)."
+    return records.count_distinct(keys)
+
+
+def cached_count_distinct(keys, records, cache):
+    """Returns `count_distinct(keys, records)`, stored in `cache` by the set of keys:
+    the count does not depend on the order of the keys.
+    """
+    keys = frozenset(keys)
+
+    if keys not in cache:
+        cache[keys] = count_distinct(keys, records)
+
+    return cache[keys]
+
+
+def cardinalities(columns, records):
+    "Returns a dictionary of {column: number of distinct values}."
+    return dict([(key, records.cardinality(key)) for key in columns])
+
+
+def lower_bound(key_order, records, depth=2, cache=None):
+    """Returns a cheap lower bound on the number of constraints `key_order` gives:
+    the distinct count of its first `depth` keys (never including the last key).
+
+    Counts are stored in `cache` (if given), keyed by the set of keys, so they
+    are shared between all key orders that start with the same keys.
+    """
+    if cache is None:
+        cache = {}
+
+    return cached_count_distinct(key_order[:min(depth, len(key_order) - 1)], records, cache)
+
+
+def key_order_for_last_key(columns, last_key):
+    """Returns the key order that ends with `last_key`, with the other columns
+    kept in their original order. This is the first order, in `permutations(columns)`
+    order, that ends with `last_key` - so it is the one the exhaustive search would pick.
+    """
+    return tuple([key for key in columns if key != last_key] + [last_key])
+
+
+def _beats(count, index, best_count, best_index):
+    """Returns True if a candidate (`count`, `index`) beats the current best.
+
+    The exhaustive search keeps the first permutation with a strictly lower
+    count. Amongst last keys with equal counts, the one with the highest column
+    index comes first in `permutations(columns)`, so that one wins ties.
+    """
+    if count < best_count:
+        return True
+
+    return count == best_count and best_index is not None and index > best_index
+
+
+def heuristic_search(columns, records, verbose=False):
+    """Finds the key order giving the fewest constraints, without generating
+    the constraints for every permutation of `columns`.
+
+    Candidate last keys are seeded in order of decreasing cardinality (a high
+    cardinality last key usually gives the fewest constraints). For each candidate,
+    the leading keys are added one at a time (again by decreasing cardinality) and
+    the distinct count of the partial prefix is checked against the best count so
+    far. As soon as the bound shows the candidate cannot win it is pruned.
+
+    The result is the same key order (and count) that the exhaustive search finds.
+
+    Args:
+        columns (list): a list of keys
+        records (RecordMatrix): the encoded records
+
+    Returns:
+        tuple: (key_order, count) - `key_order` is None if no order gives
+               fewer constraints than there are records.
+    """
+    columns = list(columns)
+    cards = cardinalities(columns, records)
+    index = dict([(key, i) for i, key in enumerate(columns)])
+
+    seeds = sorted(columns, key=lambda key: (cards[key], index[key]), reverse=True)
+
+    # Distinct counts depend only on the set of keys, so cache them by frozenset
+    cache = dict([(frozenset([key]), count) for key, count in cards.items()])
+    best_count, best_key = len(records), None
+    evaluated = pruned = 0
+
+    for last_key in seeds:
+        prefix = sorted([key for key in columns if key != last_key],
+                        key=lambda key: (cards[key], index[key]), reverse=True)
+        count = 0
+
+        for depth in range(1, len(prefix) + 1):
+            keys = frozenset(prefix[:depth])
+
+            if keys not in cache:
+                cache[keys] = count_distinct(prefix[:depth], records)
+                evaluated += 1
+
+            count = cache[keys]
+
+            if not _beats(count, index[last_key], best_count,
+                          None if best_key is None else index[best_key]):
+                break
+        else:
+            best_count, best_key = count, last_key
+            if verbose:
+                print(f'[INFO] Best so far: {best_count} with last key: {best_key}')
+            continue
+
+        pruned += 1
+
+    stats.count('distinct_counts_evaluated', evaluated)
+    stats.count('last_keys_pruned', pruned)
+
+    print(f'[INFO] Heuristic search: {evaluated} distinct counts evaluated, '
+          f'{pruned} of {len(seeds)} candidate last keys pruned.')
+
+    if best_key is None:
+        return None, best_count
+
+    return key_order_for_last_key(columns, best_key), best_count
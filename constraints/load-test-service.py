@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+Load-tests a running `serve-constraints.py` service.
+
+Random selections (see `query.random_selections`) are drawn from the options the
+service reports for a domain, and sent as "valid" and "options" queries over
+`--concurrency` keep-alive connections. Each response time is recorded and the
+p50/p99 latency and throughput are reported, with the service's cache counters.
+
+Selections are drawn from a pool of `--distinct` selections, so that repeated
+selections (as from real users) exercise the cache.
+
+Usage:
+
+    python load-test-service.py -d land -n 20000 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from query import random_selections
+
+
+async def request(reader, writer, method, path, body=None):
+    "Sends one request on a keep-alive connection and returns the decoded JSON response."
+    content = json.dumps(body).encode('utf-8') if body is not None else b''
+
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n'
+                 f'Content-Length: {len(content)}\r\n\r\n'.encode('latin-1') + content)
+    await writer.drain()
+
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+    status = int(head.split(' ')[1])
+    length = [int(line.split(':')[1]) for line in head.split('\r\n')
+              if line.lower().startswith('content-length:')][0]
+
+    response = json.loads(await reader.readexactly(length))
+
+    if status != 200:
+        raise Exception(f'{method} {path} failed ({status}): {response}')
+
+    return response
+
+
+async def client(host, port, queries, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        for path, selection in queries:
+            start = time.perf_counter()
+            await request(reader, writer, 'POST', path, selection)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def load_test(args):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    options = (await request(reader, writer, 'GET', f'/{args.domain}/options'))['options']
+
+    pool = random_selections(options, args.distinct, seed=args.seed)
+    rng = random.Random(args.seed)
+
+    queries = [(f'/{args.domain}/{rng.choice(["valid", "options"])}', rng.choice(pool))
+               for _ in range(args.n_requests)]
+
+    latencies = []
+    start = time.perf_counter()
+
+    await asyncio.gather(*[client(args.host, args.port, queries[i::args.concurrency], latencies)
+                           for i in range(args.concurrency)])
+
+    elapsed = time.perf_counter() - start
+    service_stats = await request(reader, writer, 'GET', '/stats')
+    writer.close()
+
+    times = np.array(latencies) * 1000
+    print(f'[INFO] {len(times)} requests in {elapsed:.2f} s: {len(times) / elapsed:.0f} requests/s')
+    print(f'[INFO] Latency: p50 {np.percentile(times, 50):.2f} ms, p99 {np.percentile(times, 99):.2f} ms, '
+          f'max {times.max():.2f} ms')
+    print(f'[INFO] Service: {service_stats}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--domain', required=True, help='Domain to query, e.g. land')
+    parser.add_argument('--host', default='127.0.0.1', help='Service host')
+    parser.add_argument('-p', '--port', type=int, default=8642, help='Service port')
+    parser.add_argument('-n', '--n-requests', type=int, default=10000, help='Number of requests')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of connections')
+    parser.add_argument('--distinct', type=int, default=1000,
+                        help='Number of distinct selections to draw the requests from')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+    asyncio.run(load_test(args))
+
+
+if __name__ == '__main__':
+
+    main()
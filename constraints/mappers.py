@@ -1,9 +1,21 @@
 import sys
-sys.path.append('../../cdm-lens/cdm_interface')
-
+import os
 import copy
+import functools
+import hashlib
+import json
+
+import calendar_rules
+
+
+# Path to the `wfs_mappings` module in the sibling "cdm-lens" checkout
+CDM_INTERFACE_PATH = '../../cdm-lens/cdm_interface'
 
-from wfs_mappings import wfs_mappings
+# Local snapshot of the mappings (see `snapshot-mappings.py`)
+SNAPSHOT_FILE = os.environ.get('WFS_MAPPINGS_SNAPSHOT',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            'wfs-mappings.json'))
+SNAPSHOT_VERSION = 1
 
 
 name_mappers = {
@@ -15,57 +27,136 @@ name_mappers = {
 
 #special_cases = { 'data_quality': (['quality_controlled'], ['all_data', 'quality_controlled']) }
 
-DAY_MONTHS = {
-    31: ['01', '03', '05', '07', '08', '10', '12'],
-    30: ['04', '06', '09', '11'],
-    28: ['02']
-}
 
+def content_hash(mappings):
+    "Returns the sha256 hex digest of the {key: {label: code}} `mappings`."
+    content = json.dumps(mappings, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
-def rev_mapper(key):
-    return dict([(v, k) for k, v in wfs_mappings[key]['fields'].items()])
 
+def import_wfs_mappings():
+    """Imports the {key: {label: code}} tables used by `name_mappers` from the
+    `wfs_mappings` module in the sibling "cdm-lens" checkout.
+    """
+    if CDM_INTERFACE_PATH not in sys.path:
+        sys.path.append(CDM_INTERFACE_PATH)
+
+    from wfs_mappings import wfs_mappings
+
+    return dict([(key, dict(wfs_mappings[key]['fields']))
+                 for key in sorted(set(name_mappers.values()))])
 
-def ftime(seq):
-    "Format time list into strings of double digits"
-    return [f'{tm:02d}' for tm in seq]
 
+def write_snapshot(fpath, mappings):
+    "Writes `mappings` to snapshot file `fpath`, with its version and content hash."
+    snapshot = {'version': SNAPSHOT_VERSION,
+                'sha256': content_hash(mappings),
+                'mappings': mappings}
 
-def gather_months_by_length(months, n_days):
-    print(months, n_days, set(DAY_MONTHS[n_days]) & set(months))
-    return list(set(DAY_MONTHS[n_days]) & set(months))
+    with open(fpath, 'w') as writer:
+        json.dump(snapshot, writer, indent=4, sort_keys=True)
 
 
-def replicate_record_for_months(din, months, n_days):
-    """Returns a replice of dictionary `din` where the 'month' is `months` and 'day' is a list
-    of formatted days from ["01", ... "{n_days}"]
+def read_snapshot(fpath):
+    """Reads the mappings from snapshot file `fpath`, checking its version and
+    content hash.
+
+    Returns:
+        tuple: (mappings, sha256)
     """
-    dout = copy.deepcopy(din)
+    with open(fpath) as reader:
+        snapshot = json.load(reader)
 
-    dout['month'] = months
-    dout['day'] = ftime(range(1, n_days + 1))
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise Exception(f'Unsupported mappings snapshot version {snapshot.get("version")} '
+                        f'(expected {SNAPSHOT_VERSION}): {fpath}')
 
-    return dout
+    mappings = snapshot['mappings']
+    sha256 = content_hash(mappings)
 
+    if sha256 != snapshot['sha256']:
+        raise Exception(f'Content hash of mappings snapshot does not match: {fpath} '
+                        f'(re-create it with snapshot-mappings.py)')
 
-def expand_over_months(din):
-    """Looks up months and then expands one dict into a list of dicts by grouping
-    months of similar length per dict.
-    
-    Returns: list of dictionaries.
+    return mappings, sha256
+
+
+@functools.lru_cache(maxsize=None)
+def load_mappings():
+    """Returns the {key: {label: code}} mappings and their content hash.
+
+    They are read from the local snapshot if there is one, otherwise they are
+    imported from the sibling "cdm-lens" checkout.
+
+    Returns:
+        tuple: (mappings, sha256)
+    """
+    if os.path.isfile(SNAPSHOT_FILE):
+        return read_snapshot(SNAPSHOT_FILE)
+
+    mappings = import_wfs_mappings()
+    return mappings, content_hash(mappings)
+
+
+class UnmappedCodeError(KeyError):
+    "Raised when a constraint holds codes that have no label in `wfs_mappings`."
+
+    def __init__(self, key, codes):
+        self.key = key
+        self.codes = sorted(codes)
+        super().__init__(f'No "{key}" label for codes: {self.codes} '
+                         f'(known codes: {sorted(rev_mapper(key))})')
+
+    def __str__(self):
+        return self.args[0]
+
+
+@functools.lru_cache(maxsize=None)
+def rev_mapper(key):
+    "Returns the {code: label} table for `key`, built once and then reused."
+    return dict([(v, k) for k, v in load_mappings()[0][key].items()])
+
+
+def map_values(nkey, values, cache=None):
+    """Returns the list of labels for codes `values` of (output) key `nkey`.
+
+    Lists are interned in `cache`: the same codes give the same list object.
+
+    Raises:
+        UnmappedCodeError: if any code has no label
     """
-    months = din['month']
-    new_records = []
+    values = tuple(values)
+
+    if cache is not None and (nkey, values) in cache:
+        return cache[(nkey, values)]
+
+    field_mapper = rev_mapper(nkey)
+    missing = [_ for _ in values if _ not in field_mapper]
+
+    if missing:
+        raise UnmappedCodeError(nkey, missing)
+
+    mapped = [field_mapper[_] for _ in values]
 
-    for n_days in sorted(DAY_MONTHS.keys()):
-        picked_months = gather_months_by_length(months, n_days)
-        if not picked_months: continue
+    if cache is not None:
+        cache[(nkey, values)] = mapped
 
-        print(picked_months)
-        new_record = replicate_record_for_months(din, picked_months, n_days)
-        new_records.append(new_record)
+    return mapped
+
+
+def ftime(seq):
+    "Format time list into strings of double digits"
+    return [f'{tm:02d}' for tm in seq]
+
+
+def expand_over_months(din):
+    """Looks up months and then expands one dict into a list of dicts by grouping
+    months of similar length per dict (see `calendar_rules.expand_constraint`).
+    February is split by leap year if `din` has a 'year'.
 
-    return new_records
+    Returns: list of dictionaries.
+    """
+    return list(calendar_rules.expand_constraint(din))
 
 
 def NOT_USED_add_time_inputs(d):
@@ -100,11 +191,12 @@ def NOT_USED_add_time_inputs(d):
 #        d['hour'] = ftime(all_hours)
 
 
-def map_dict(din):
+def map_dict(din, cache=None):
     """Apply mappers to input dictionary, into output dictionary.
 
     Args:
         din ([dict]): input constraints
+        cache (dict): interned output lists, shared between calls (optional)
 
     Returns:
         [dict]: output constraints
@@ -115,10 +207,13 @@ def map_dict(din):
         nkey = name_mappers.get(key, key)
 
         if key in name_mappers:
-            field_mapper = rev_mapper(nkey) 
-            value = [field_mapper[_] for _ in value]
+            value = map_values(nkey, value, cache)
+        elif cache is not None:
+            value = cache.setdefault((nkey, tuple(value)), list(value))
+        else:
+            value = value[:]
 
-        dout[nkey] = value[:]
+        dout[nkey] = value
 
 #    print('[INFO] Applying special cases of superset mappings')
 #    for key, value in dout.items():
@@ -135,12 +230,15 @@ def map_constraints(cin):
     For each dictionary:
      - constraints are mapped
 
-    A new list of dictionaries is returned.
+    A new list of dictionaries is returned. Identical value lists are
+    mapped once and the output lists are shared between constraints, so
+    they should not be modified in place.
     """
     cout = []
+    cache = {}
 
     for din in cin:
-        dout = map_dict(din) 
+        dout = map_dict(din, cache)
 #        add_time_inputs(dout)
 #        expanded_douts = expand_over_months(dout)
 #        cout.extend(expanded_douts)
@@ -150,6 +248,39 @@ def map_constraints(cin):
 
 
 
+def unmap_dict(dout):
+    """Reverses `map_dict`: turns the labels in output constraint `dout` back
+    into codes, under the input keys.
+
+    Raises:
+        Exception: if any label has no code
+    """
+    input_names = dict([(nkey, key) for key, nkey in name_mappers.items()])
+    mappings = load_mappings()[0]
+    din = {}
+
+    for nkey, value in dout.items():
+        key = input_names.get(nkey, nkey)
+
+        if key in name_mappers:
+            fields = mappings[nkey]
+            missing = [_ for _ in value if _ not in fields]
+
+            if missing:
+                raise Exception(f'No "{nkey}" code for labels: {missing}')
+
+            value = [fields[_] for _ in value]
+
+        din[key] = value
+
+    return din
+
+
+def unmap_constraints(cout):
+    "Reverses `map_constraints` (see `unmap_dict`)."
+    return [unmap_dict(dout) for dout in cout]
+
+
 def test_mappers():
     cin = [{'quality_flag': ['0'], 'report_type': ['3'], 'frequency': ['daily'],
             'data_policy_licence': ['0'], 'variable': ['44'], 'month': ['01', '02', '03', '04']}]
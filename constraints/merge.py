@@ -0,0 +1,226 @@
+"""
+Merge engine for minimised constraints.
+
+Each constraint is a cross product of value sets: a dictionary of
+{key: frozenset}. Any group of constraints that are identical in every
+key but one can be replaced by a single constraint holding the union of
+that key's values. `merge_constraints` applies such merges, one key at a
+time, until no key gives any further reduction.
+
+This is the same merge that re-running `minimise()` on its own output
+performs, but the groups are found with a hash index per key rather
+than by sorting the constraints for every permutation of the keys.
+"""
+
+import stats
+from record_matrix import intern_values, value_sort_key
+
+
+def _others(con, key, columns):
+    return tuple([con[k] for k in columns if k != key])
+
+
+def count_groups(constraints, key, columns):
+    "Returns the number of constraints left after merging along `key`."
+    return len(set(_others(con, key, columns) for con in constraints))
+
+
+def merge_along(constraints, key, columns):
+    """Merges all `constraints` that are identical apart from `key`.
+
+    The result is ordered as `generate_constraints` would order it for the
+    key order: `columns` (without `key`), then `key`.
+    """
+    groups = {}
+
+    for con in constraints:
+        groups.setdefault(_others(con, key, columns), []).append(con[key])
+
+    key_order = [k for k in columns if k != key] + [key]
+    merged = []
+
+    for others, values in groups.items():
+        con = dict(zip(key_order[:-1], others))
+        con[key] = intern_values(frozenset().union(*values))
+        merged.append(con)
+
+    merged.sort(key=lambda con: [value_sort_key(con[k]) for k in key_order])
+    return merged
+
+
+def merge_constraints(constraints, verbose=False):
+    """Repeatedly merges `constraints` along whichever key removes the most
+    constraints, until no key gives a reduction.
+
+    Ties go to the key that sorts last, which is the choice `minimise()` makes.
+
+    Args:
+        constraints (list): a list of constraints ({key: frozenset} dictionaries)
+
+    Returns:
+        list: a list of merged constraints
+    """
+    if not constraints:
+        return constraints
+
+    columns = sorted(constraints[0].keys())
+
+    while True:
+        counts = [(count_groups(constraints, key, columns), -i, key)
+                  for i, key in enumerate(columns)]
+        count, _, key = min(counts)
+
+        if verbose:
+            print(f'[INFO] Constraints left after merging along each key: {counts}')
+
+        if count >= len(constraints):
+            break
+
+        print(f'[INFO] Merging along "{key}": from {len(constraints)} to {count}')
+        stats.count('merge_rounds')
+
+        with stats.timed('merge_along', key=key, constraints_in=len(constraints),
+                         constraints_out=count):
+            constraints = merge_along(constraints, key, columns)
+
+    return constraints
+
+
+def subtract_point(con, point, columns):
+    """Returns constraints that cover everything `con` covers except `point`
+    (which `con` must cover). They do not overlap, and there is at most one
+    per key in `columns`.
+    """
+    pieces = []
+    fixed = {}
+
+    for key in columns:
+        rest = con[key] - {point[key]}
+
+        if rest:
+            piece = dict(con)
+            piece.update(fixed)
+            piece[key] = intern_values(rest)
+            pieces.append(piece)
+
+        fixed[key] = intern_values((point[key],))
+
+    return pieces
+
+
+class CoverIndex(object):
+    """Finds the constraints covering a point without scanning them all: for
+    each key, a hash index of {value: ids of the constraints allowing it}. The
+    covering constraints are the intersection of the ids for each key of the point.
+    """
+
+    def __init__(self, constraints, columns):
+        self.columns = columns
+        self.constraints = {}
+        self.indexes = dict([(key, {}) for key in columns])
+        self._next_id = 0
+
+        for con in constraints:
+            self.add(con)
+
+    def add(self, con):
+        "Adds constraint `con` and returns its id."
+        con_id = self._next_id
+        self._next_id += 1
+
+        self.constraints[con_id] = con
+        for key in self.columns:
+            index = self.indexes[key]
+            for value in con[key]:
+                index.setdefault(value, set()).add(con_id)
+
+        return con_id
+
+    def remove(self, con_id):
+        "Removes the constraint with id `con_id` and returns it."
+        con = self.constraints.pop(con_id)
+
+        for key in self.columns:
+            index = self.indexes[key]
+            for value in con[key]:
+                index[value].discard(con_id)
+
+        return con
+
+    def covering(self, point):
+        "Returns the ids of the constraints that cover `point` (a {key: value} dictionary)."
+        candidates = sorted([self.indexes[key].get(point[key], set()) for key in self.columns], key=len)
+        ids = set(candidates[0])
+
+        for other in candidates[1:]:
+            if not ids:
+                break
+            ids &= other
+
+        return ids
+
+    def values(self):
+        return list(self.constraints.values())
+
+
+def merge_touched(constraints, touched, columns):
+    """Merges the `touched` constraints with any others that are identical apart
+    from one key, repeatedly, leaving constraints that were not touched (or
+    merged with a touched one) alone.
+
+    Args:
+        constraints (list): a list of constraints ({key: frozenset} dictionaries)
+        touched (list): the constraints (also in `constraints`) that have changed
+        columns (list): the keys of the constraints
+
+    Returns:
+        list: a list of constraints
+    """
+    boxes = set(tuple([con[key] for key in columns]) for con in constraints)
+
+    # For each key: the constraints grouped by their values for the other keys
+    indexes = [{} for _ in columns]
+
+    def _add(box):
+        boxes.add(box)
+        for i, index in enumerate(indexes):
+            index.setdefault(box[:i] + box[i + 1:], set()).add(box)
+
+    def _remove(box):
+        boxes.discard(box)
+        for i, index in enumerate(indexes):
+            index[box[:i] + box[i + 1:]].discard(box)
+
+    for box in list(boxes):
+        _add(box)
+
+    pending = [tuple([con[key] for key in columns]) for con in touched]
+
+    while pending:
+        box = pending.pop()
+
+        if box not in boxes:
+            continue
+
+        for i, index in enumerate(indexes):
+            group = index[box[:i] + box[i + 1:]]
+
+            if len(group) < 2:
+                continue
+
+            members = list(group)
+            for other in members:
+                _remove(other)
+
+            values = intern_values(frozenset().union(*[other[i] for other in members]))
+            merged = box[:i] + (values,) + box[i + 1:]
+            _add(merged)
+
+            stats.count('local_merges')
+            pending.append(merged)
+            break
+
+    merged = [dict(zip(columns, box)) for box in boxes]
+    merged.sort(key=lambda con: [value_sort_key(con[k]) for k in columns])
+    return merged
+
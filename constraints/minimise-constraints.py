@@ -1,12 +1,22 @@
 from itertools import permutations
+import multiprocessing
 import os
 import argparse
-import copy
 import sys
 import json
 
 
+import numpy as np
+
+import calendar_rules
+import external_sort
 import mappers
+import merge
+import key_orders
+import result_cache
+import stats
+import verify
+from record_matrix import RecordMatrix, intern_values, read_counts, value_lists
 
 
 VERBOSE = True
@@ -25,116 +35,165 @@ bryn	exmouth	young	spurs	mary
 """.strip().split('\n')
 
 
-def split_line(line, delimiter=','):
-    if not delimiter:
-        # I.e. None, i.e. white space
-        resp = line.strip().split(delimiter)
+def parse_input(fpath, remove_zero_counts=False, delimiter=',', memory_budget=None, tmp_dir=None):
+    """Reads the counts file `fpath`. With a `memory_budget` (in bytes), the
+    records are spilled to `tmp_dir` as they are read (see `external_sort.py`).
+    """
+    if memory_budget:
+        def builder_class(columns):
+            return external_sort.SpillingRecordBuilder(columns, memory_budget=memory_budget,
+                                                       tmp_dir=tmp_dir)
+
+        n_lines, records = read_counts(fpath, remove_zero_counts=remove_zero_counts,
+                                       delimiter=delimiter, builder_class=builder_class,
+                                       chunk_size=external_sort.read_chunk_size(memory_budget))
+        print(f'[INFO] Spilled the records to {len(records.runs)} runs in: {records.spill_dir}')
     else:
-        resp = line.strip().replace(' ', '').replace('\t', '').split(delimiter)
-    
-    return resp
- 
+        n_lines, records = read_counts(fpath, remove_zero_counts=remove_zero_counts,
+                                       delimiter=delimiter)
 
-def parse_input(fpath, remove_zero_counts=False, delimiter=','):
+    print(f'[INFO] Read in {n_lines} lines.')
+    print(f'[INFO] Parsed {len(records)} records.')
+    return records.columns, records
 
-    with open(fpath) as reader: 
-        data = reader.read().strip().split('\n')
 
-    print(f'[INFO] Read in {len(data) - 1} lines.')
+def resort_by_keys(key_order, records):
+    "Returns the codes of `records` for `key_order`, sorted by `key_order`."
+    return records.sorted_codes(key_order)
 
-    columns = split_line(data[0], delimiter)
- 
-    count_column = -1
-    if remove_zero_counts:
-        count_column = columns.index('count')
 
-    records = []
+def generate_constraints(key_order, records):
+    """Based on a proposed order of keys (`key_order`), reprocess
+    a set of records to return a list of new constraints.
 
+    Args:
+        key_order (list): a list of keys
+        records (RecordMatrix or SpilledRecords): the encoded records
 
-    for items in sorted(data[1:]):
-        items = split_line(items, delimiter)
+    Returns:
+        list: a list of constraints
 
-        if remove_zero_counts and int(items[count_column]) == 0:
-            continue
+    Each constraint is a dictionary of {key: frozenset}. Where the records are
+    themselves constraints, the values of the last key are merged by union.
+    """
+    spilled = isinstance(records, external_sort.SpilledRecords)
 
-        records.append({})
+    with stats.timed('generate_constraints', key_order=key_order, records_in=len(records),
+                     spilled=spilled) as event:
+        if spilled:
+            constraints = list(iter_spilled_constraints(key_order, records))
+        else:
+            constraints = _generate_constraints(key_order, records)
+        event['constraints_out'] = len(constraints)
 
-        for i in range(len(items)):
-            key = columns[i]
+    return constraints
 
-            if key == 'domain': 
-                continue
 
-            if remove_zero_counts and key == 'count':
-                continue
+def _generate_constraints(key_order, records):
+    recs = resort_by_keys(key_order, records)
 
-            records[-1][key] = items[i]
+    if VERBOSE:
+        print(f'[INFO] Generating constraints for key order: {key_order}')
+    else:
+        print('.', end='', flush=True)
 
-    if 'domain' in columns:
-        columns.remove('domain')
+    if len(recs) == 0:
+        return []
 
-    if remove_zero_counts and 'count' in columns:
-        columns.remove('count')
+    # A new constraint starts wherever any key but the last one changes value
+    changed = np.any(recs[1:, :-1] != recs[:-1, :-1], axis=1)
+    starts = np.flatnonzero(np.concatenate(([True], changed)))
 
-    print(f'[INFO] Parsed {len(records)} records.')
-    return columns, records
+    ends = np.append(starts[1:], len(recs))
 
+    sets = [records.value_sets(key) for key in key_order]
+    leading, last_key = key_order[:-1], key_order[-1]
 
-def resort_by_keys(key_order, records):
-    nr = [[_[key] for key in key_order] for _ in records]
-    nr.sort()
+    firsts = recs[starts, :-1].tolist()
+    last_values = [sets[-1][code] for code in recs[:, -1].tolist()]
 
-    return [dict([(key, [_[i]]) for i, key in enumerate(key_order)]) for _ in nr]
+    constraints = []
 
+    for first, start, end in zip(firsts, starts.tolist(), ends.tolist()):
+        con = dict([(key, sets[i][first[i]]) for i, key in enumerate(leading)])
+        con[last_key] = intern_values(frozenset().union(*last_values[start:end]))
+        constraints.append(con)
 
+    return constraints
 
-def generate_constraints(key_order, records):
-    """Based on a proposed order of keys (`key_order`), reprocess
-    a set of records to return a list of new constraints.
 
-    Args:
-        key_order (list): a list of keys
-        records (list): a list of records
+def iter_spilled_constraints(key_order, records):
+    """Yields the constraints for `key_order` from `SpilledRecords`, streaming
+    the sorted combinations of the records' codes from disk.
 
-    Returns:
-        list: a list of constraints
+    The constraints are the same, and in the same order, as those from
+    `_generate_constraints`.
     """
-    recs = resort_by_keys(key_order, records)
-    constraints = []
-    last_rec = [[] for _ in range(len(key_order))]
-
     if VERBOSE:
-        print(f'[INFO] Generating constraints for key order: {key_order}')
-    else:
-        print('.', end='', flush=True)
+        print(f'[INFO] Generating constraints on disk for key order: {key_order}')
 
-    # Loop through all records, processing them into new constraints object
-    for rec in recs:
+    sets = [records.value_sets(key) for key in key_order]
+    leading, last_key = key_order[:-1], key_order[-1]
+    n_last = len(sets[-1])
 
-        extend = True
-        values = []
+    current, last_codes = None, set()
 
-        for i, key in enumerate(key_order):
-            value = rec[key][0]
+    def _constraint():
+        codes = records.decode_key(current, leading)
+        con = dict([(key, sets[i][code]) for i, (key, code) in enumerate(zip(leading, codes))])
+        con[last_key] = intern_values(frozenset().union(*[sets[-1][code] for code in last_codes]))
+        return con
 
-            if value not in last_rec[i] and i != (len(key_order) - 1):
-                extend = False
+    for block in records.iter_sorted_keys(key_order):
+        # The combined key of the leading keys, and the code of the last key
+        leads, lasts = np.divmod(block, n_last)
 
-            values.append([value])
+        starts = np.flatnonzero(np.concatenate(([True], leads[1:] != leads[:-1])))
+        ends = np.append(starts[1:], len(block))
 
-        if extend:
-            constraints[-1][key_order[-1]].append(value)
+        lasts = lasts.tolist()
 
-        else:
-            new_rec = dict([(key_order[i], values[i]) for i in range(len(key_order))])
-            constraints.append(new_rec)
+        for lead, start, end in zip(leads[starts].tolist(), starts.tolist(), ends.tolist()):
+            # A group can carry on from the previous block
+            if lead != current:
+                if current is not None:
+                    yield _constraint()
 
-        last_rec = values[:]
+                current, last_codes = lead, set()
 
-    return constraints
+            last_codes.update(lasts[start:end])
+
+    if current is not None:
+        yield _constraint()
+
+
+def minimise(columns, records, search='exhaustive', workers=1, warm_start=None):
+    """Returns the constraints for the key order of `columns` that gives the
+    fewest constraints (see `find_key_order`).
+    """
+    if not isinstance(records, RecordMatrix):
+        records = RecordMatrix.from_records(columns, records)
+
+    key_order = find_key_order(columns, records, search=search, workers=workers,
+                               warm_start=warm_start)
+
+    if not key_order:
+        return records.to_records()
 
+    return generate_constraints(key_order, records)
 
-def minimise(columns, records):
+
+def find_key_order(columns, records, search='exhaustive', workers=1, warm_start=None):
+    """Returns the key order of `columns` that gives the fewest constraints for
+    `records` (a RecordMatrix), or None if no key order reduces the records.
+
+    `warm_start` is an optional key order that was best for similar records
+    (e.g. a previous run on an earlier version of the input). Its count is used
+    as the bound to beat from the start, so that more key orders are pruned.
+    The result is the same as without it.
+    """
+    if search == 'heuristic':
+        return heuristic_key_order(columns, records)
 
     key_perms = [_ for _ in permutations(columns)]
 
@@ -145,112 +204,160 @@ def minimise(columns, records):
 
     best = [-1, len(records), None]
 
+    # Distinct counts by set of keys, shared by the lower bounds and the
+    # constraint counts: all the permutations with the same leading keys
+    # (in any order) give the same count
+    counts = {}
+
+    if warm_start and sorted(warm_start) == sorted(columns):
+        # Key orders that tie with the warm start must still be found, as the
+        # first of them wins
+        best[1] = min(best[1], key_orders.cached_count_distinct(warm_start[:-1], records, counts) + 1)
+        print(f'[INFO] Warm start from {tuple(warm_start)}: looking for {best[1] - 1} or fewer constraints')
+
+    if workers > 1:
+        parallel_counts(key_perms, records, workers, counts, best[1])
+
+    pruned = 0
+
     for count, key_order in enumerate(key_perms):
 
-        #start_r = copy.deepcopy(records)
-        constraints = generate_constraints(key_order, records)
-        #end_r = copy.deepcopy(records)
-        #assert start_r == end_r
+        # Skip orders that cannot beat the best, before generating anything
+        if key_orders.lower_bound(key_order, records, cache=counts) >= best[1]:
+            pruned += 1
+            stats.count('permutations_pruned')
+            continue
 
-        if len(constraints) < best[1]:
-            print(f'\n[INFO] Length vs best: {len(constraints)} VS {best[1]}')
+        stats.count('permutations_evaluated')
 
-            best = [count, len(constraints), copy.deepcopy(constraints[:])]
-            print('HACK HACK HACK: checked length==17238 - does it help?')
-            if best[1] == 17238:
-                break
+        # Only the count is needed to compare key orders: the constraints for
+        # the best one are generated once, at the end
+        n_constraints = key_orders.cached_count_distinct(key_order[:-1], records, counts)
 
-            if VERBOSE and None:
-                for con in constraints: 
-                    if con.get('variable') == ['36']: 
-                        print(f'[DEBUG] Logging presence of variable "36"')
+        if n_constraints >= best[1]:
+            pruned += 1
+            stats.count('permutations_abandoned')
+            continue
+
+        print(f'\n[INFO] Length vs best: {n_constraints} VS {best[1]}')
 
-                    if con.get('data_policy_licence') == ['0']:
-                        print(f'[DEBUG] Logging presence of "open" data')
+        best = [count, n_constraints, key_order]
+        print('HACK HACK HACK: checked length==17238 - does it help?')
+        if best[1] == 17238:
+            break
 
-            print(f'[INFO] Length: {len(constraints)} for {key_order}')
+        print(f'[INFO] Length: {n_constraints} for {key_order}')
 
-    if not best[2]:
-        best[2] = records
+    print(f'\n[INFO] Abandoned {pruned} of {len(key_perms)} key orders that could not beat the best')
 
     return best[2]
 
 
-def _encode_rec(rec):
-    nd = {}
+_WORKER_RECORDS = None
 
-    for k, value in rec.items():
-        value = str(value).replace('[', '').replace(']', '').replace(' ', '___')
-        nd[k] = value
 
-    return nd
+def _init_worker(records):
+    "Pool initializer: keeps one copy of the records in each worker process."
+    global _WORKER_RECORDS
+    _WORKER_RECORDS = records
 
+    # Only the main process writes stats
+    stats.disable()
 
-def encode_records(c):
-    n = []
 
-    for i in c:
-        nd = _encode_rec(i)
-        n.append(nd)
+def _count_distinct(keys):
+    return key_orders.count_distinct(keys, _WORKER_RECORDS)
 
-    return n
 
+def parallel_counts(key_perms, records, workers, counts, bound):
+    """Fills `counts` with the distinct counts of the leading keys of the key
+    orders in `key_perms`, across a pool of `workers` processes.
 
-def sort_records(c):
-    n = []
-    sorted_keys = sorted(c[0].keys())
+    Only the distinct sets of leading keys are counted, and not those whose
+    lower bound shows they cannot give fewer than `bound` constraints. The
+    records are handed to each worker once (by the pool initializer) and only
+    the counts come back. The key orders are then compared in the main
+    process, in order, so the same key order wins as without workers.
+    """
+    todo = []
 
-    c_as_strs = []
+    for key_order in key_perms:
+        keys = frozenset(key_order[:-1])
 
-    for rec in c:
+        if keys in counts or keys in todo:
+            continue
 
-        r_str = ''
-        for key in sorted_keys:
-            value = rec[key]
-            r_str += f'{key}={value}&'
-           
-        c_as_strs.append(r_str)
+        if key_orders.lower_bound(key_order, records, cache=counts) >= bound:
+            continue
 
-    c_as_strs.sort()
+        todo.append(keys)
 
-    for rec in c_as_strs:
-        d = dict([tuple(_.split('=')) for _ in rec.strip('&').split('&')])
-        n.append(d)
+    print(f'[INFO] Counting {len(todo)} sets of leading keys with {workers} workers')
 
-    return n
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(records,)) as pool:
+        counts.update(zip(todo, pool.map(_count_distinct, [tuple(sorted(keys)) for keys in todo])))
 
 
-def _decode_rec(rec):
-    nd = {}
+def heuristic_key_order(columns, records):
+    """Returns the key order found by `key_orders.heuristic_search`, rather than
+    counting the constraints for every permutation of `columns`.
+    """
+    key_order, count = key_orders.heuristic_search(columns, records, verbose=VERBOSE)
 
-    for k, value in rec.items():
-        if VERBOSE: print(f'[WARN] VALUE IS: {value}', end='  ')
+    if key_order:
+        print(f'[INFO] Length: {count} for {key_order}')
 
-        nv = []
+    return key_order
 
-        for _ in value:
-            nvalue = eval(_.replace('___', ' ')) 
-            nv.append(nvalue)
 
-        if VERBOSE: print(f'decodes to: {nv}')
- 
-        # Fix when tuple
-        if type(nv[0]) == tuple:
-            nv = list(nv[0])
+def _init_shard_worker():
+    # Only the main process writes stats
+    stats.disable()
 
-        nd[k] = nv
 
-    return nd
+def _minimise_shard(task):
+    values, shard, search = task
+    return values, minimise(shard.columns, shard, search=search)
 
 
-def decode_records(c):
-    n = []
+def minimise_sharded(columns, records, shard_by, search='exhaustive', workers=1):
+    """Minimise `records` separately for each combination of the `shard_by` keys.
 
-    for i in c:
-        nd = _decode_rec(i)
-        n.append(nd)
+    Each shard is minimised over the other columns only (so there are far fewer
+    key orders to try) in a pool of `workers` processes, and the `shard_by`
+    values are then added back to its constraints. Merging across shards is
+    left to `merge.merge_constraints`.
+    """
+    if not isinstance(records, RecordMatrix):
+        records = RecordMatrix.from_records(columns, records)
+
+    tasks = [(values, shard, search) for values, shard in records.partition(shard_by)]
+    print(f'[INFO] Minimising {len(tasks)} shards (by {", ".join(shard_by)}) with {workers} workers')
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_shard_worker)
+        results = pool.imap(_minimise_shard, tasks)
+    else:
+        pool = None
+        results = map(_minimise_shard, tasks)
 
-    return n 
+    constraints = []
+
+    try:
+        for values, shard_constraints in results:
+            stats.count('shards_minimised')
+            fixed = [(key, intern_values((value,))) for key, value in values.items()]
+
+            for con in shard_constraints:
+                # Re-intern values that were pickled back from a worker
+                constraints.append(dict([(key, intern_values(value)) for key, value in con.items()]
+                                        + fixed))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return constraints
 
 
 def parse_args():
@@ -262,6 +369,36 @@ def parse_args():
                         required=False, help='Delimiter')
     parser.add_argument('-z', '--remove-zero-counts', action='store_true',
                         required=False, help='Removes records where count is zero')
+    parser.add_argument('-s', '--search', choices=['exhaustive', 'heuristic'],
+                        default='exhaustive', required=False,
+                        help='Key order search: try every permutation (exhaustive) or '
+                             'prune with distinct-count bounds (heuristic)')
+    parser.add_argument('-w', '--workers', type=int, default=1, required=False,
+                        help='Number of processes used to evaluate key orders')
+    parser.add_argument('--shard-by', required=False,
+                        help='Comma-separated keys (e.g. "variable,report_type"): minimise the '
+                             'records for each combination of their values separately')
+    parser.add_argument('-c', '--calendar-days', action='store_true', required=False,
+                        help='Input has no "day" column: write all valid days for each '
+                             'year/month in the output constraints (except monthly ones)')
+    parser.add_argument('--verify', action='store_true', required=False,
+                        help='Check that the constraints cover exactly the combinations in '
+                             'the records, after minimising and after merging')
+    parser.add_argument('--cache-dir', required=False,
+                        help='Cache results in this directory, and reuse them when the input '
+                             'and options have not changed')
+    parser.add_argument('--cache-size', type=int, default=1024, required=False,
+                        help='Maximum size of the cache (MB), beyond which the least recently '
+                             'used results are removed')
+    parser.add_argument('--memory-budget', type=int, required=False,
+                        help='Keep the records on disk, and use about this many MB at a time '
+                             'to read, count and sort them (for inputs larger than memory)')
+    parser.add_argument('--tmp-dir', required=False,
+                        help='Directory for the records spilled with --memory-budget')
+    parser.add_argument('--stats-file', required=False,
+                        help='Write per-stage timings and counters to this file (JSON lines)')
+    parser.add_argument('--profile', required=False,
+                        help='Run under cProfile and write the profile to this file')
     parser.add_argument('-i', '--input-file', required=True, help='Input file')
     parser.add_argument('-o', '--output-file', required=True, help='Output file')
 
@@ -277,19 +414,7 @@ def _check_variables_not_lost(obj, domain):
     found_vars = set()
 
     for rec in obj:
-        item = rec['variable']
-
-        if isinstance(item, str):
-            item = item.strip("[").strip("]").split(',')
-
-        for x in item:
-            y = x.replace('"', '').replace("'", "").replace('_', '')
-
-            if ',' in y:
-                for i in y.split(','):
-                    found_vars.add(i)
-            else:
-                found_vars.add(y)
+        found_vars.update(rec['variable'])
 
     if domain == 'land':
         req_vars = {'36', '44', '45', '53', '55', '57', '58', '85', '106', '107'}
@@ -305,50 +430,182 @@ def _check_variables_not_lost(obj, domain):
         print(f'[INFO] All variables are still there!')
     
 
-def main():
+def cache_keys(args, shard_by):
+    "Returns the result cache keys for each stage, for the input and options in `args`."
+    with stats.timed('hash_input', input_file=args.input_file):
+        input_hash = result_cache.file_hash(args.input_file)
 
-    args = parse_args()
-    set_verbose(args.verbose)
+    # Only the options that change the results
+    options = {'remove_zero_counts': args.remove_zero_counts, 'delimiter': args.delimiter,
+               'search': args.search, 'shard_by': shard_by}
+
+    return {'options': options,
+            'minimise': result_cache.cache_key('minimise', input_hash, options),
+            'final': result_cache.cache_key('final', input_hash, options, mappers.load_mappings()[1])}
+
+
+def run(args):
+    "Runs all stages and returns the mapped constraints and the number of records read in."
+
+    domain = os.path.basename(args.input_file).split('.')[2]
+    shard_by = args.shard_by.split(',') if args.shard_by else []
+
+    cache = None
+    if args.cache_dir:
+        cache = result_cache.ResultCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024)
+        keys = cache_keys(args, shard_by)
+
+    # Verifying needs the records, so cached results are not read back (but
+    # the new results are still cached)
+    use_cached = cache and not args.verify
+    if cache and args.verify:
+        print(f'[INFO] Not using cached results, so that they can be verified (--verify)')
+
+    if use_cached:
+        entry = cache.get(keys['final'])
+        if entry:
+            print(f'[INFO] Using cached constraints for unchanged input: {args.input_file}')
+            return entry['constraints'], entry['n_records']
+
+    entry = cache.get(keys['minimise']) if use_cached else None
+    records = None
+
+    if entry:
+        print(f'[INFO] Using cached minimised constraints for unchanged input: {args.input_file}')
+        constraints = result_cache.load_constraints(entry['constraints'])
+        n_recs = entry['n_records']
+    else:
+        records, constraints = run_minimise(args, shard_by, cache=cache,
+                                            keys=keys if cache else None)
+        n_recs = len(records)
+
+    print("""
+--- MERGING ---
+---------------------
+---------------------""")
+    with stats.timed('merge_constraints', constraints_in=len(constraints)) as event:
+        constraints = merge.merge_constraints(constraints, verbose=VERBOSE)
+        event['constraints_out'] = len(constraints)
+
+    if args.verify:
+        with stats.timed('verify', after='merge', constraints_in=len(constraints)):
+            verify.verify_coverage(records, constraints)
+
+    with stats.timed('check_variables_not_lost', domain=domain):
+        _check_variables_not_lost(constraints, domain)
+
+    print(f'[INFO] Mapping constraints to values required by CDS')
+    with stats.timed('map_constraints', constraints_in=len(constraints)):
+        constraints = mappers.map_constraints(value_lists(constraints))
+
+    if cache:
+        cache.put(keys['final'], {'n_records': n_recs, 'constraints': constraints})
+
+    return constraints, n_recs
+
+
+def run_minimise(args, shard_by, cache=None, keys=None):
+    "Reads the input and minimises it. Returns the records and the minimised constraints."
 
     print("""
 --- ITERATION 0 ---
 ---------------------
 ---------------------""")
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+
+    if memory_budget and (shard_by or args.verify):
+        raise Exception('--shard-by and --verify need the records in memory, '
+                        'so they cannot be used with --memory-budget')
+
     # First iteration uses input from file
-    columns, records = parse_input(args.input_file, remove_zero_counts=args.remove_zero_counts,
-                             delimiter=args.delimiter)
+    with stats.timed('parse_input', input_file=args.input_file) as event:
+        columns, records = parse_input(args.input_file, remove_zero_counts=args.remove_zero_counts,
+                                       delimiter=args.delimiter, memory_budget=memory_budget,
+                                       tmp_dir=args.tmp_dir)
+        event['records_out'] = len(records)
+
+    try:
+        return _minimise_records(args, columns, records, shard_by, cache, keys)
+    finally:
+        if memory_budget:
+            records.close()
+
+
+def _minimise_records(args, columns, records, shard_by, cache, keys):
+    "Minimises the records read by `run_minimise`, and returns the same."
     n_recs = len(records)
-    domain = os.path.basename(args.input_file).split('.')[2]
 
-    print(f'[INFO] Processing {n_recs} records')
-    constraints = minimise(columns, records)
+    for key in shard_by:
+        if key not in columns:
+            raise Exception(f'Cannot shard by "{key}": not one of the columns {columns}')
 
-    N_ITERATIONS = 200
+    if args.calendar_days and 'day' in columns:
+        raise Exception(f'The input already has a "day" column, so calendar days (-c) '
+                        f'cannot be added: {args.input_file}')
 
-    for i in range(N_ITERATIONS):
-        print(f"""
---- ITERATION {i+1} ---
----------------------
----------------------""")
-        
-        encoded = encode_records(constraints)
-        encoded = sort_records(encoded)
+    if shard_by and len(shard_by) >= len(columns):
+        raise Exception(f'Cannot shard by every column: {shard_by}')
 
-        columns = sorted(encoded[0].keys())
+    # The best key order for earlier input with the same columns is a good
+    # starting point (whatever the input hash)
+    warm_start = None
+    if cache:
+        domain = os.path.basename(args.input_file).split('.')[2]
+        keys['key_order'] = result_cache.cache_key('key_order', domain, sorted(columns), keys['options'])
 
-        next_constraints = minimise(columns, encoded)
+        entry = cache.get(keys['key_order'])
+        warm_start = entry and entry['key_order']
 
-        _check_variables_not_lost(next_constraints, domain)
+    key_order = None
 
-        if len(next_constraints) < len(constraints):
-            print(f'\n[INFO] Minimising from {len(constraints)} to {len(next_constraints)}')
-            constraints = copy.deepcopy(decode_records(next_constraints))
+    print(f'[INFO] Processing {n_recs} records')
+    with stats.timed('minimise', search=args.search, workers=args.workers, shard_by=shard_by,
+                     records_in=n_recs) as event:
+        if shard_by:
+            constraints = minimise_sharded(columns, records, shard_by, search=args.search,
+                                           workers=args.workers)
         else:
-            print(f'\n[INFO] Exiting because lengths are: {len(constraints)} and {len(next_constraints)}')
-            break
+            key_order = find_key_order(columns, records, search=args.search, workers=args.workers,
+                                       warm_start=warm_start)
+            constraints = generate_constraints(key_order, records) if key_order else records.to_records()
 
-    print(f'[INFO] Mapping constraints to values required by CDS')
-    constraints = mappers.map_constraints(constraints)
+        event['constraints_out'] = len(constraints)
+
+    if args.verify:
+        with stats.timed('verify', after='minimise', constraints_in=len(constraints)):
+            verify.verify_coverage(records, constraints)
+
+    if cache:
+        cache.put(keys['minimise'], {'n_records': n_recs,
+                                     'constraints': result_cache.dump_constraints(constraints)})
+        if key_order:
+            cache.put(keys['key_order'], {'key_order': list(key_order)})
+
+    return records, constraints
+
+
+def main():
+
+    args = parse_args()
+    set_verbose(args.verbose)
+
+    if args.stats_file:
+        stats.enable(args.stats_file)
+
+    if args.profile:
+        stats.start_profile()
+
+    try:
+        constraints, n_records = run(args)
+    finally:
+        if args.profile:
+            stats.stop_profile(args.profile)
+
+        stats.close()
+
+    if args.calendar_days:
+        print(f'[INFO] Expanding calendar rules into days')
+        constraints = list(calendar_rules.expand_constraints(constraints))
 
     print(f'[INFO] Final constraints:')
     total = 0
@@ -362,7 +619,7 @@ def main():
         print(f'\tCOUNT: {n}:  {constr}')
 
     print(f'\n[INFO] Length: {len(constraints)}')
-    print(f'[INFO] Record count from file: {len(records)}')
+    print(f'[INFO] Record count from file: {n_records}')
     print(f'[INFO] Record count from minimisation: {total}') 
 
     json_file = args.output_file
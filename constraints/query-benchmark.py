@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the query engine (`query.py`) on a constraints file, by replaying
+random form selections against it.
+
+Each selection picks a random subset of the keys and, for each of them, a few
+random values (from those found in the constraints). Both `is_valid` and
+`remaining_options` are timed per query, and the batch API is timed over all
+the selections.
+
+Usage:
+
+    python query-benchmark.py -i constraints-land.json -n 10000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from query import ConstraintIndex, random_selections
+
+
+def time_queries(func, selections):
+    "Returns the time taken (in microseconds) by `func` for each selection."
+    times = []
+
+    for selection in selections:
+        start = time.perf_counter()
+        func(selection)
+        times.append((time.perf_counter() - start) * 1e6)
+
+    return np.array(times)
+
+
+def report(name, times):
+    print(f'[INFO] {name}: mean {times.mean():.1f} us, p50 {np.percentile(times, 50):.1f} us, '
+          f'p99 {np.percentile(times, 99):.1f} us, max {times.max():.1f} us')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-i', '--input-file', required=True, help='Constraints file (JSON)')
+    parser.add_argument('-n', '--n-queries', type=int, default=10000, help='Number of selections')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    start = time.perf_counter()
+    index = ConstraintIndex.from_file(args.input_file)
+    print(f'[INFO] Indexed {index.size} constraints over {len(index.keys)} keys in '
+          f'{time.perf_counter() - start:.3f} s')
+
+    selections = random_selections(index.options, args.n_queries, seed=args.seed)
+
+    valid = index.is_valid_many(selections)
+    print(f'[INFO] {sum(valid)} of {len(selections)} random selections are valid')
+
+    report('is_valid', time_queries(index.is_valid, selections))
+    report('remaining_options', time_queries(index.remaining_options, selections))
+
+    for name, func in [('is_valid_many', index.is_valid_many),
+                       ('remaining_options_many', index.remaining_options_many)]:
+        start = time.perf_counter()
+        func(selections)
+        elapsed = time.perf_counter() - start
+        print(f'[INFO] {name}: {len(selections) / elapsed:.0f} selections/s')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,139 @@
+"""
+Query engine for CDS form selections, over a (mapped) `constraints.json`.
+
+Each constraint is a cross product of value lists. For every key and value,
+the index holds a bitmap (a Python int) with bit `i` set if constraint `i`
+allows that value. A selection is a dictionary of {key: [values]} for the
+widgets that have something selected. A constraint matches a selection if,
+for every selected key, it allows at least one of the selected values:
+
+    matches = AND over selected keys of (OR of the bitmaps of the selected values)
+
+This is how the CDS form narrows its options:
+
+ - `is_valid(selection)`: at least one constraint matches, so the selection
+   can be submitted
+ - `remaining_options(selection)`: for each key, the values that would still
+   be valid, given the selections for all the *other* keys
+
+Usage:
+
+    index = ConstraintIndex.from_file('constraints-land.json')
+    index.is_valid({'variable': ['accumulated_precipitation'], 'year': ['1901']})
+    index.remaining_options({'variable': ['accumulated_precipitation']})['month']
+"""
+
+import random
+
+import numpy as np
+
+import json_stream
+
+
+def _bitmap(positions, size):
+    "Returns a bitmap (int) with the bits at `positions` set."
+    bits = np.zeros(size, dtype=bool)
+    bits[positions] = True
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+
+class ConstraintIndex(object):
+
+    def __init__(self, constraints):
+        """
+        Args:
+            constraints (list): a list of {key: [values]} dictionaries (as in `constraints.json`)
+        """
+        positions = {}
+
+        for i, con in enumerate(constraints):
+            for key, values in con.items():
+                for value in values:
+                    positions.setdefault(key, {}).setdefault(value, []).append(i)
+
+        self.size = len(constraints)
+        self.all = (1 << self.size) - 1
+
+        self.keys = sorted(positions)
+        self.options = dict([(key, sorted(positions[key])) for key in self.keys])
+        self.bitmaps = dict([(key, dict([(value, _bitmap(positions[key][value], self.size))
+                                         for value in self.options[key]]))
+                             for key in self.keys])
+
+    @classmethod
+    def from_file(cls, fpath):
+        "Builds the index for the constraints JSON file `fpath`."
+        with open(fpath) as reader:
+            return cls(list(json_stream.iter_json_array(reader)))
+
+    def _selected(self, key, values):
+        "Returns the bitmap of the constraints allowing any of `values` for `key`."
+        bitmaps = self.bitmaps.get(key, {})
+        mask = 0
+
+        for value in values:
+            mask |= bitmaps.get(value, 0)
+
+        return mask
+
+    def matching(self, selection, exclude=None):
+        "Returns the bitmap of the constraints matching `selection` (ignoring key `exclude`)."
+        mask = self.all
+
+        for key, values in selection.items():
+            if key == exclude or not values:
+                continue
+
+            mask &= self._selected(key, values)
+
+            if not mask:
+                break
+
+        return mask
+
+    def is_valid(self, selection):
+        "Returns True if at least one constraint matches `selection`."
+        return self.matching(selection) != 0
+
+    def remaining_options(self, selection):
+        """Returns {key: [values]}: for each key, the values that are still valid
+        given the selections for all the other keys (in sorted order).
+        """
+        remaining = {}
+        full = self.matching(selection)
+
+        for key in self.keys:
+            # Only a key that is itself selected has a different mask
+            mask = self.matching(selection, exclude=key) if selection.get(key) else full
+            bitmaps = self.bitmaps[key]
+
+            remaining[key] = [value for value in self.options[key] if bitmaps[value] & mask]
+
+        return remaining
+
+    def is_valid_many(self, selections):
+        "Returns a list of `is_valid` answers for `selections`."
+        return [self.is_valid(selection) for selection in selections]
+
+    def remaining_options_many(self, selections):
+        "Returns a list of `remaining_options` answers for `selections`."
+        return [self.remaining_options(selection) for selection in selections]
+
+
+def random_selections(options, n, max_values=3, seed=0):
+    "Returns `n` random selections ({key: [values]}) from `options` ({key: [values]})."
+    rng = random.Random(seed)
+    keys = sorted(options)
+    selections = []
+
+    for _ in range(n):
+        selection = {}
+
+        for key in rng.sample(keys, rng.randint(1, len(keys))):
+            values = options[key]
+            selection[key] = rng.sample(values, rng.randint(1, min(max_values, len(values))))
+
+        selections.append(selection)
+
+    return selections
+
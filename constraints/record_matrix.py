@@ -0,0 +1,420 @@
+"""
+Compact in-memory store for count records.
+
+Each column is dictionary-encoded: its distinct values are held once in a
+sorted code table, and every record is a row of `int32` codes pointing into
+those tables. Because the code tables are sorted, sorting rows by their codes
+gives the same order as sorting the original string values.
+
+Values are either single strings (records read from a counts file) or
+frozensets of strings (constraints being re-minimised). Constraints are kept
+as dictionaries of {key: frozenset}, with identical sets interned so that they
+are shared rather than duplicated.
+"""
+
+from array import array
+
+import numpy as np
+
+
+CODE_DTYPE = np.int32
+
+# Approximate number of bytes read from a counts file at a time
+CHUNK_SIZE = 16 * 1024 * 1024
+
+COLUMNAR_EXTENSIONS = ('.parquet', '.feather', '.arrow')
+
+
+_INTERNED = {}
+
+
+def intern_values(values):
+    "Returns a shared frozenset of `values`."
+    values = frozenset(values)
+    return _INTERNED.setdefault(values, values)
+
+
+def as_value_set(value):
+    "Returns `value` as a frozenset of values, if it is not one already."
+    if isinstance(value, frozenset):
+        return value
+
+    return intern_values((value,))
+
+
+def value_sort_key(value):
+    "Sort key that orders frozensets by their sorted contents and strings as strings."
+    if isinstance(value, frozenset):
+        return tuple(sorted(value))
+
+    return (value,)
+
+
+def value_lists(constraints):
+    """Returns `constraints` with each frozenset of values turned into a sorted list.
+
+    Each distinct frozenset is sorted once, and its list is shared by every
+    constraint that holds it.
+    """
+    lists = {}
+
+    def sorted_list(value):
+        if value not in lists:
+            lists[value] = sorted(value)
+        return lists[value]
+
+    return [dict([(key, sorted_list(value)) for key, value in con.items()]) for con in constraints]
+
+
+def distinct_sorted(values):
+    """Returns the distinct values of integer array `values`, sorted.
+
+    Same as `np.unique(values)`, which is several times slower on large
+    integer arrays with recent versions of numpy.
+    """
+    values = np.sort(values)
+
+    if values.size == 0:
+        return values
+
+    return values[np.concatenate(([True], values[1:] != values[:-1]))]
+
+
+class RecordMatrix(object):
+
+    def __init__(self, columns, codes, tables):
+        """
+        Args:
+            columns (list): a list of keys
+            codes (numpy.ndarray): an (n_records, n_columns) array of codes
+            tables (list): one sorted list of values per column
+        """
+        self.columns = list(columns)
+        self.codes = codes
+        self.tables = tables
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        "Encodes `rows` (a list of value lists, in `columns` order)."
+        tables = [sorted(set(row[i] for row in rows), key=value_sort_key)
+                  for i in range(len(columns))]
+        codes = np.empty((len(rows), len(columns)), dtype=CODE_DTYPE, order='F')
+
+        for i, table in enumerate(tables):
+            lookup = dict([(value, code) for code, value in enumerate(table)])
+            codes[:, i] = np.fromiter((lookup[row[i]] for row in rows),
+                                      dtype=CODE_DTYPE, count=len(rows))
+
+        return cls(columns, codes, tables)
+
+    @classmethod
+    def from_records(cls, columns, records):
+        "Encodes `records` (a list of dictionaries keyed by `columns`)."
+        return cls.from_rows(columns, [[rec[key] for key in columns] for rec in records])
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def indexes(self, keys):
+        return [self.columns.index(key) for key in keys]
+
+    def cardinality(self, key):
+        return len(self.tables[self.columns.index(key)])
+
+    def sort_order(self, key_order):
+        "Returns the row order that sorts the records by `key_order`."
+        # `lexsort` treats its last key as the primary one
+        return np.lexsort([self.codes[:, i] for i in reversed(self.indexes(key_order))])
+
+    def sorted_codes(self, key_order):
+        "Returns an (n_records, len(key_order)) array of codes sorted by `key_order`."
+        return self.codes[np.ix_(self.sort_order(key_order), self.indexes(key_order))]
+
+    def count_distinct(self, keys):
+        "Returns the number of distinct combinations of `keys` across the records."
+        if len(self) == 0:
+            return 0
+
+        if not keys:
+            return 1
+
+        indexes = self.indexes(keys)
+        sizes = [len(self.tables[i]) for i in indexes]
+
+        if np.prod(sizes, dtype=float) < 2 ** 62:
+            # Combine the codes into a single integer per record
+            combined = np.zeros(len(self), dtype=np.int64)
+
+            for i, size in zip(indexes, sizes):
+                combined *= size
+                combined += self.codes[:, i]
+
+            return distinct_sorted(combined).size
+
+        recs = self.sorted_codes(keys)
+        return 1 + int(np.count_nonzero(np.any(recs[1:] != recs[:-1], axis=1)))
+
+    def select(self, rows, columns=None):
+        """Returns a new `RecordMatrix` holding the records at `rows`, with only
+        `columns` (default: all). Code tables only keep the values still used.
+        """
+        columns = self.columns if columns is None else list(columns)
+        codes = np.empty((len(rows), len(columns)), dtype=CODE_DTYPE, order='F')
+        tables = []
+
+        for j, i in enumerate(self.indexes(columns)):
+            used, inverse = np.unique(self.codes[rows, i], return_inverse=True)
+            codes[:, j] = inverse.reshape(-1)
+            tables.append([self.tables[i][code] for code in used.tolist()])
+
+        return RecordMatrix(columns, codes, tables)
+
+    def partition(self, keys):
+        """Splits the records by their values of `keys`, in sorted order.
+
+        Yields:
+            tuple: ({key: value} for `keys`, a `RecordMatrix` of the other columns)
+        """
+        order = self.sort_order(keys)
+        recs = self.codes[np.ix_(order, self.indexes(keys))]
+
+        starts = np.flatnonzero(np.any(recs[1:] != recs[:-1], axis=1)) + 1
+        starts = np.concatenate([[0], starts]) if len(recs) else starts
+        ends = np.append(starts[1:], len(recs))
+
+        others = [key for key in self.columns if key not in keys]
+
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            values = dict([(key, self.decode(key, [code])[0])
+                           for key, code in zip(keys, recs[start].tolist())])
+            yield values, self.select(order[start:end], others)
+
+    def decode(self, key, codes):
+        "Returns the values for a sequence of `codes` in column `key`."
+        table = self.tables[self.columns.index(key)]
+        return [table[code] for code in codes]
+
+    def value_sets(self, key):
+        "Returns the code table for column `key` with every value as a frozenset."
+        return [as_value_set(value) for value in self.tables[self.columns.index(key)]]
+
+    def to_records(self):
+        "Returns the records as a list of dictionaries of {key: frozenset}."
+        columns = [[sets[code] for code in self.codes[:, i].tolist()]
+                   for i, sets in enumerate([self.value_sets(key) for key in self.columns])]
+
+        return [dict([(key, columns[i][n]) for i, key in enumerate(self.columns)])
+                for n in range(len(self))]
+
+
+class RecordMatrixBuilder(object):
+    """Builds a `RecordMatrix` incrementally, so that records can be encoded as
+    they are read instead of being held as strings first.
+
+    Codes are assigned in order of first appearance while reading, and are
+    renumbered into sorted order by `build()`.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self._lookups = [{} for _ in self.columns]
+        self._codes = [array('i') for _ in self.columns]
+
+    def __len__(self):
+        return len(self._codes[0]) if self._codes else 0
+
+    def extend(self, rows):
+        "Adds `rows` (a list of value lists, in `columns` order)."
+        for i, lookup in enumerate(self._lookups):
+            self._codes[i].extend([lookup.setdefault(row[i], len(lookup)) for row in rows])
+
+    def extend_encoded(self, i, values, indices):
+        """Adds already dictionary-encoded values to column `i`: `values` is the
+        dictionary and `indices` (an integer array) points into it, one per record.
+        """
+        lookup = self._lookups[i]
+        remap = np.array([lookup.setdefault(value, len(lookup)) for value in values],
+                         dtype=CODE_DTYPE)
+
+        self._codes[i].frombytes(remap[indices].astype(CODE_DTYPE).tobytes())
+
+    def sorted_tables(self):
+        """Returns the sorted code tables, and for each column the array that maps
+        its provisional codes onto the sorted ones.
+
+        Returns:
+            tuple: (tables, remaps)
+        """
+        tables, remaps = [], []
+
+        for lookup in self._lookups:
+            table = sorted(lookup, key=value_sort_key)
+            sorted_codes = dict([(value, code) for code, value in enumerate(table)])
+
+            remap = np.empty(len(lookup), dtype=CODE_DTYPE)
+            for value, code in lookup.items():
+                remap[code] = sorted_codes[value]
+
+            tables.append(table)
+            remaps.append(remap)
+
+        return tables, remaps
+
+    def build(self):
+        codes = np.empty((len(self), len(self.columns)), dtype=CODE_DTYPE, order='F')
+        tables, remaps = self.sorted_tables()
+
+        for i, remap in enumerate(remaps):
+            codes[:, i] = remap[np.frombuffer(self._codes[i], dtype=CODE_DTYPE)]
+
+            # Release the provisional codes as we go
+            self._codes[i] = array('i')
+
+        return RecordMatrix(self.columns, codes, tables)
+
+
+def split_line(line, delimiter=','):
+    if not delimiter:
+        # I.e. None, i.e. white space
+        resp = line.strip().split(delimiter)
+    else:
+        resp = line.strip().replace(' ', '').replace('\t', '').split(delimiter)
+
+    return resp
+
+
+def read_counts(fpath, remove_zero_counts=False, delimiter=',', chunk_size=CHUNK_SIZE,
+                builder_class=RecordMatrixBuilder):
+    """Streams a counts file into a `RecordMatrix`, reading `chunk_size` bytes
+    (approximately) at a time. The "domain" column is dropped while reading, as are
+    the "count" column and zero-count rows if `remove_zero_counts` is set.
+
+    The records are built by `builder_class(columns)`: e.g. an
+    `external_sort.SpillingRecordBuilder` to keep them on disk instead.
+
+    The rows are not sorted here: `RecordMatrix.sort_order` puts them in order
+    for whichever key order is needed.
+
+    Parquet and feather (Arrow IPC) files, as written by `add-days-to-counts.py`,
+    are read with `read_columnar_counts` instead.
+
+    Returns:
+        tuple: (n_lines, records) - the number of data lines read and the records.
+    """
+    if fpath.endswith(COLUMNAR_EXTENSIONS):
+        return read_columnar_counts(fpath, remove_zero_counts=remove_zero_counts,
+                                    builder_class=builder_class)
+
+    n_lines = 0
+
+    with open(fpath) as reader:
+        columns = split_line(reader.readline(), delimiter)
+
+        count_column = columns.index('count') if remove_zero_counts else -1
+        keep = [i for i, key in enumerate(columns)
+                if key != 'domain' and not (remove_zero_counts and key == 'count')]
+
+        builder = builder_class([columns[i] for i in keep])
+
+        for lines in iter(lambda: reader.readlines(chunk_size), []):
+            rows = []
+
+            for line in lines:
+                if not line.strip():
+                    continue
+
+                n_lines += 1
+                items = split_line(line, delimiter)
+
+                if remove_zero_counts and int(items[count_column]) == 0:
+                    continue
+
+                rows.append([items[i] for i in keep])
+
+            builder.extend(rows)
+
+    return n_lines, builder.build()
+
+
+def _record_batches(fpath):
+    "Yields the record batches of a parquet or feather file."
+    try:
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception(f'The "pyarrow" package is required to read: {fpath}')
+
+    if fpath.endswith('.parquet'):
+        yield from pyarrow.parquet.ParquetFile(fpath).iter_batches()
+    else:
+        reader = pyarrow.ipc.open_file(fpath)
+
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def _dictionary_encoded(column):
+    "Returns `column` as a dictionary-encoded array of strings."
+    import pyarrow
+
+    if not pyarrow.types.is_dictionary(column.type):
+        return column.cast(pyarrow.string()).dictionary_encode()
+
+    if not pyarrow.types.is_string(column.type.value_type):
+        return column.dictionary_decode().cast(pyarrow.string()).dictionary_encode()
+
+    return column
+
+
+def _count_values(column):
+    "Returns the `count` column as a numpy array of int64 (only converting it if it is not integer)."
+    import pyarrow
+
+    if pyarrow.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+
+    if not pyarrow.types.is_integer(column.type):
+        column = column.cast(pyarrow.int64())
+
+    return column.to_numpy(zero_copy_only=False)
+
+
+def read_columnar_counts(fpath, remove_zero_counts=False, builder_class=RecordMatrixBuilder):
+    """Reads a parquet or feather counts file into a `RecordMatrix`, one record
+    batch at a time. The dictionaries of the encoded columns are mapped onto the
+    record codes directly, so no values are parsed per record.
+
+    Returns:
+        tuple: (n_lines, records) - the number of rows read and the records.
+    """
+    builder = None
+    n_lines = 0
+
+    for batch in _record_batches(fpath):
+
+        if builder is None:
+            columns = batch.schema.names
+            keep = [i for i, key in enumerate(columns)
+                    if key != 'domain' and not (remove_zero_counts and key == 'count')]
+            builder = builder_class([columns[i] for i in keep])
+
+        n_lines += batch.num_rows
+        rows = None
+
+        if remove_zero_counts:
+            counts = _count_values(batch.column(columns.index('count')))
+            rows = np.flatnonzero(counts != 0)
+
+        for j, i in enumerate(keep):
+            column = _dictionary_encoded(batch.column(i))
+            indices = column.indices.to_numpy(zero_copy_only=False)
+
+            if rows is not None:
+                indices = indices[rows]
+
+            builder.extend_encoded(j, column.dictionary.to_pylist(), indices)
+
+    if builder is None:
+        raise Exception(f'No record batches found in: {fpath}')
+
+    return n_lines, builder.build()
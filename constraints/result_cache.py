@@ -0,0 +1,132 @@
+"""
+Content-addressed on-disk cache of minimisation results.
+
+Each entry is a JSON file named by a sha256 key, built from everything the
+result depends on: the stage, a hash of the input counts file, the options
+that change the result and (for mapped constraints) the hash of the
+mappings. A rerun on unchanged input therefore finds its results without
+recomputing anything, and any change to the input gives new keys.
+
+When the total size of the entries goes over the limit, the least recently
+used entries are removed (each hit updates the entry's modification time).
+"""
+
+import hashlib
+import json
+import os
+
+import stats
+from record_matrix import intern_values, value_lists
+
+
+# Default size limit, in bytes
+CACHE_SIZE = 1024 * 1024 * 1024
+
+# Number of bytes read at a time when hashing a file
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(fpath):
+    "Returns the sha256 hex digest of the contents of `fpath`."
+    digest = hashlib.sha256()
+
+    with open(fpath, 'rb') as reader:
+        for block in iter(lambda: reader.read(BLOCK_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    "Returns the sha256 hex digest of `parts` (any JSON-serialisable values)."
+    content = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def dump_constraints(constraints):
+    "Returns `constraints` ({key: frozenset} dictionaries) in a form that can be written as JSON."
+    return value_lists(constraints)
+
+
+def load_constraints(constraints):
+    "Returns `constraints` read from JSON as {key: frozenset} dictionaries, with interned values."
+    return [dict([(key, intern_values(value)) for key, value in con.items()])
+            for con in constraints]
+
+
+class ResultCache(object):
+
+    def __init__(self, cache_dir, max_size=CACHE_SIZE):
+        """
+        Args:
+            cache_dir (str): directory holding the entries (created if needed)
+            max_size (int): total size of the entries (in bytes) to evict down to
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        "Returns the entry (a dictionary) stored under `key`, or None."
+        path = self._path(key)
+
+        try:
+            with open(path) as reader:
+                entry = json.load(reader)
+        except (OSError, ValueError):
+            stats.count('cache_misses')
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        stats.count('cache_hits')
+
+        return entry
+
+    def put(self, key, entry):
+        "Stores `entry` (a JSON-serialisable dictionary) under `key`, then evicts if needed."
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+
+        with open(tmp_path, 'w') as writer:
+            json.dump(entry, writer)
+
+        # Readers never see a partly written entry
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def entries(self):
+        "Returns a list of (mtime, size, path) for every entry, least recently used first."
+        entries = []
+
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+
+            path = os.path.join(self.cache_dir, name)
+            info = os.stat(path)
+            entries.append((info.st_mtime, info.st_size, path))
+
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        "Removes the least recently used entries (except `keep`) until the cache fits `max_size`."
+        entries = self.entries()
+        total = sum([size for _, size, _ in entries])
+
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+
+            if path == keep:
+                continue
+
+            os.remove(path)
+            total -= size
+
+            stats.count('cache_evictions')
+            print(f'[INFO] Evicted from cache: {path}')
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the constraints pipeline on synthetic counts files.
+
+For each benchmark case, a counts file is generated (with `generate-counts.py`)
+and each stage is run and measured:
+
+ - parse:    `parse_input()` (with zero counts removed)
+ - minimise: `minimise()`
+ - merge:    `merge.merge_constraints()`
+ - map:      `mappers.map_constraints()`
+ - add_days: `add-days-to-counts.py` (cases without a "day" column only)
+
+One JSON line per stage is appended to the results file, with the wall time,
+peak RSS and number of records/constraints out, plus the git commit - so that
+results files from different commits can be compared with `--compare`.
+
+Each case runs in its own process, so that peak memory is not shared between cases.
+
+Usage:
+
+    python run-benchmarks.py -c 1e4 1e5
+    python run-benchmarks.py --compare old-results.jsonl benchmark-results.jsonl
+"""
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+# Generator settings for each case, named by the approximate number of rows.
+# Only real variable codes are used, so that the "map" stage can map them.
+CASES = {
+    '1e4': dict(n_variables=10, n_report_types=2, start_year=2000),
+    '1e5': dict(n_variables=10, n_report_types=3, start_year=1900),
+    '1e5-sparse': dict(n_variables=10, n_report_types=3, start_year=1900, sparsity=0.6),
+    '1e5-5vars': dict(n_variables=5, n_report_types=3, n_licences=3, start_year=1850),
+    '1e5-marine': dict(domain='marine', n_variables=6, n_report_types=2, n_licences=1,
+                       start_year=1851),
+    '1e6': dict(n_variables=10, n_report_types=3, start_year=1970, days=True),
+    '1e7': dict(n_variables=10, n_report_types=3, start_year=1761, days=True)
+}
+
+DEFAULT_CASES = ['1e4', '1e5', '1e5-sparse', '1e5-5vars', '1e5-marine', '1e6']
+
+
+def load_script(name):
+    "Imports one of the (hyphenated) scripts in this directory as a module."
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'),
+                                                  os.path.join(HERE, f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def reset_peak_rss():
+    "Resets the peak RSS of this process (Linux only), so each stage is measured separately."
+    try:
+        with open('/proc/self/clear_refs', 'w') as writer:
+            writer.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as reader:
+            for line in reader:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def counts_file(data_dir, case):
+    settings = CASES[case]
+    domain = settings.get('domain', 'land')
+
+    # The domain is read from the third part of the file name, and the hash
+    # of the settings makes sure a file is regenerated if they change
+    tag = hashlib.md5(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:8]
+    return os.path.join(data_dir, f'matches.lite_2_0.{domain}.bench-{case}-{tag}')
+
+
+def run_stage(results, name, func, *args):
+    "Runs `func(*args)` with its output silenced, and records the time and peak memory."
+    reset_peak_rss()
+    start = time.perf_counter()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        output = func(*args)
+
+    results.append({'stage': name, 'seconds': round(time.perf_counter() - start, 4),
+                    'peak_rss_kb': peak_rss_kb(), 'count_out': len(output)})
+    return output
+
+
+def run_add_days(results, fpath):
+    "Runs `add-days-to-counts.py` as a separate process and records its time and peak memory."
+    start = time.perf_counter()
+
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'add-days-to-counts.py'), fpath],
+                            stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+
+    output = f'{fpath}.days'
+    results.append({'stage': 'add_days', 'seconds': round(time.perf_counter() - start, 4),
+                    'peak_rss_kb': usage.ru_maxrss, 'status': status,
+                    'bytes_out': os.path.getsize(output) if os.path.exists(output) else None})
+
+    if os.path.exists(output):
+        os.remove(output)
+
+
+def run_case(case, fpath, search, add_days):
+    "Runs all stages for one case, returning a list of results (one per stage)."
+    minimiser = load_script('minimise-constraints')
+
+    import mappers
+    import merge
+    from record_matrix import value_lists
+
+    results = []
+
+    columns, records = run_stage(results, 'parse', minimiser.parse_input, fpath, True)
+    constraints = run_stage(results, 'minimise', minimiser.minimise, columns, records, search)
+    constraints = run_stage(results, 'merge', merge.merge_constraints, constraints)
+    run_stage(results, 'map', mappers.map_constraints, value_lists(constraints))
+
+    # `parse_input` returns (columns, records)
+    results[0]['count_out'] = len(records)
+
+    if add_days:
+        run_add_days(results, fpath)
+
+    return results
+
+
+def compare(base_file, new_file):
+    "Prints the timings and peak memory in `new_file` relative to `base_file`."
+
+    def latest(fpath):
+        results = {}
+        with open(fpath) as reader:
+            for line in reader:
+                res = json.loads(line)
+                results[(res['case'], res['stage'])] = res
+        return results
+
+    base, new = latest(base_file), latest(new_file)
+
+    print(f'{"case":<12} {"stage":<10} {"seconds":>22} {"peak RSS (MB)":>22} {"count":>14}')
+
+    for key in sorted(set(base) & set(new)):
+        b, n = base[key], new[key]
+        ratio = n['seconds'] / b['seconds'] if b['seconds'] else float('nan')
+        print(f'{key[0]:<12} {key[1]:<10} '
+              f'{b["seconds"]:>8.3f} -> {n["seconds"]:>8.3f} ({ratio:4.2f}x) '
+              f'{b["peak_rss_kb"] / 1024:>8.1f} -> {n["peak_rss_kb"] / 1024:>8.1f} '
+              f'{str(b.get("count_out")):>6} -> {str(n.get("count_out")):>6}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-c', '--cases', nargs='+', choices=sorted(CASES), default=DEFAULT_CASES,
+                        help='Cases to run')
+    parser.add_argument('-o', '--output-file', default='benchmark-results.jsonl',
+                        help='Results file (JSON lines, appended to)')
+    parser.add_argument('--data-dir', default='benchmark-data',
+                        help='Directory for the generated counts files')
+    parser.add_argument('-s', '--search', choices=['exhaustive', 'heuristic'], default='heuristic',
+                        help='Key order search used by minimise()')
+    parser.add_argument('--no-add-days', action='store_true', help='Skip the add_days stage')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='Compare two results files instead of running')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.run_case:
+        case = args.run_case
+        add_days = not (args.no_add_days or CASES[case].get('days'))
+        results = run_case(case, counts_file(args.data_dir, case), args.search, add_days)
+
+        with open(args.output_file, 'a') as writer:
+            for res in results:
+                res.update({'case': case, 'search': args.search, 'commit': git_commit(),
+                            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')})
+                writer.write(json.dumps(res) + '\n')
+                print(f'[INFO] {case}: {res}')
+        return
+
+    generator = load_script('generate-counts')
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    for case in args.cases:
+        fpath = counts_file(args.data_dir, case)
+
+        if not os.path.exists(fpath):
+            n_rows = generator.write_counts(fpath, **CASES[case])
+            print(f'[INFO] Generated {n_rows} records for case "{case}": {fpath}')
+
+        cmd = [sys.executable, os.path.abspath(__file__), '--run-case', case,
+               '-o', args.output_file, '--data-dir', args.data_dir, '-s', args.search]
+        if args.no_add_days:
+            cmd.append('--no-add-days')
+
+        subprocess.check_call(cmd)
+
+    print(f'[INFO] Wrote results to: {args.output_file}')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+"""
+Local HTTP service answering CDS form queries over constraints files
+(see `query.py`), one per domain.
+
+Endpoints (selections are JSON objects of {key: [values]}):
+
+    GET  /health                    -> {"status": "ok"}
+    GET  /stats                     -> cache and reload counters
+    GET  /<domain>/options          -> all options, {key: [values]}
+    POST /<domain>/options          -> options still valid for the selection
+    POST /<domain>/valid            -> {"valid": true/false} for the selection
+
+The indexes are built once at start-up. Answers are kept in an LRU cache of
+recent selections. Each constraints file is checked for changes every
+`--reload-interval` seconds: when `minimise-constraints.py` writes a new one,
+its index is rebuilt and swapped in (and that domain's cached answers dropped).
+If the new file cannot be read (e.g. it is still being written) or indexed, the
+old index is kept and the file is tried again once it changes.
+
+Only the standard library is used (asyncio), and the service listens on
+localhost by default.
+
+Usage:
+
+    python serve-constraints.py -c land=constraints-land.json -c marine=constraints-marine.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import time
+
+from query import ConstraintIndex
+
+
+CACHE_SIZE = 10000
+
+RELOAD_INTERVAL = 1.0
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+class LRUCache(object):
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def get(self, key):
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self, domain):
+        "Drops the cached answers for `domain`."
+        for key in [key for key in self._items if key[0] == domain]:
+            del self._items[key]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ConstraintsService(object):
+
+    def __init__(self, files, cache_size=CACHE_SIZE):
+        """
+        Args:
+            files (dict): {domain: constraints file}
+            cache_size (int): number of answers kept in the LRU cache
+        """
+        self.files = files
+        self.cache = LRUCache(cache_size)
+        self.indexes = {}
+        self.versions = {}
+        self.failed = {}
+        self.reloads = 0
+
+        for domain in files:
+            self.swap(domain, *self.build(domain))
+
+    def _version(self, domain):
+        info = os.stat(self.files[domain])
+        return (info.st_mtime_ns, info.st_size)
+
+    def build(self, domain):
+        "Returns a new index for the constraints file of `domain`, and the file version."
+        version = self._version(domain)
+        start = time.perf_counter()
+
+        index = ConstraintIndex.from_file(self.files[domain])
+
+        print(f'[INFO] Loaded {index.size} constraints for "{domain}" from '
+              f'{self.files[domain]} in {time.perf_counter() - start:.3f} s')
+        return index, version
+
+    def swap(self, domain, index, version):
+        "Puts `index` in use for `domain`, dropping the answers cached for the old one."
+        self.indexes[domain] = index
+        self.versions[domain] = version
+        self.failed.pop(domain, None)
+        self.cache.clear(domain)
+
+    async def watch(self, interval=RELOAD_INTERVAL):
+        "Reloads any constraints file that has changed, every `interval` seconds."
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await asyncio.sleep(interval)
+
+            for domain in self.files:
+                version = None
+
+                try:
+                    version = self._version(domain)
+                    if version == self.versions[domain] or version == self.failed.get(domain):
+                        continue
+
+                    # Build the new index off the event loop, then swap it in
+                    index, version = await loop.run_in_executor(None, self.build, domain)
+                    self.swap(domain, index, version)
+                    self.reloads += 1
+                except Exception as exc:
+                    # Keep the old index (and keep watching): the file is tried
+                    # again once it changes
+                    if domain in self.failed and self.failed[domain] == version:
+                        continue
+
+                    self.failed[domain] = version
+                    print(f'[WARN] Could not reload "{domain}" (will retry when it changes): '
+                          f'{type(exc).__name__}: {exc}')
+
+    def answer(self, method, path, body):
+        "Returns (status, response) for a request, with the response encoded as JSON."
+        status, response = self._answer(method, path, body)
+
+        if isinstance(response, dict):
+            response = json.dumps(response).encode('utf-8')
+
+        return status, response
+
+    def _answer(self, method, path, body):
+        parts = path.strip('/').split('/')
+
+        if parts == ['health']:
+            return 200, {'status': 'ok'}
+
+        if parts == ['stats']:
+            return 200, {'cache_size': len(self.cache), 'cache_hits': self.cache.hits,
+                         'cache_misses': self.cache.misses, 'reloads': self.reloads,
+                         'constraints': dict([(domain, index.size)
+                                              for domain, index in self.indexes.items()])}
+
+        if len(parts) != 2 or parts[0] not in self.indexes or parts[1] not in ('options', 'valid'):
+            return 404, {'error': f'Not found: {path}'}
+
+        domain, query = parts
+        index = self.indexes[domain]
+
+        if method == 'GET' and query == 'options':
+            return 200, {'options': index.options}
+
+        if method != 'POST':
+            return 405, {'error': f'Use POST for: {path}'}
+
+        try:
+            selection = json.loads(body or b'{}')
+        except ValueError as exc:
+            return 400, {'error': f'Invalid JSON: {exc}'}
+
+        if not (isinstance(selection, dict) and all(isinstance(values, list) and
+                                                    all(isinstance(_, str) for _ in values)
+                                                    for values in selection.values())):
+            return 400, {'error': 'The selection must be an object of {key: [values]}, with string values'}
+
+        key = (domain, query, json.dumps(selection, sort_keys=True))
+        response = self.cache.get(key)
+
+        if response is None:
+            if query == 'valid':
+                response = {'valid': index.is_valid(selection)}
+            else:
+                response = {'options': index.remaining_options(selection)}
+
+            # Cached already encoded
+            response = json.dumps(response).encode('utf-8')
+
+            self.cache.put(key, response)
+
+        return 200, response
+
+    async def handle(self, reader, writer):
+        "Serves the requests on one (keep-alive) connection."
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                request = lines[0].split(' ')
+                headers = dict([(name.strip().lower(), value.strip())
+                                for name, _, value in [line.partition(':') for line in lines[1:] if line]])
+
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+
+                if len(request) != 3 or length < 0:
+                    # The rest of the stream cannot be trusted: answer and close
+                    headers['connection'] = 'close'
+                    status, content = 400, json.dumps({'error': 'Malformed request'}).encode('utf-8')
+                else:
+                    try:
+                        body = await reader.readexactly(length) if length else b''
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        break
+
+                    status, content = self.answer(request[0], request[1], body)
+
+                writer.write(f'HTTP/1.1 {status} {STATUS[status]}\r\n'
+                             f'Content-Type: application/json\r\n'
+                             f'Content-Length: {len(content)}\r\n\r\n'.encode('latin-1') + content)
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        finally:
+            writer.close()
+
+
+async def serve(service, host, port, reload_interval):
+    server = await asyncio.start_server(service.handle, host, port)
+    watcher = asyncio.create_task(service.watch(reload_interval))
+    watcher.add_done_callback(_watcher_done)
+
+    print(f'[INFO] Serving {", ".join(service.files)} on http://{host}:{port}')
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        watcher.cancel()
+
+
+def _watcher_done(watcher):
+    "Reports the reload watcher stopping, other than by being cancelled at shutdown."
+    if watcher.cancelled():
+        return
+
+    print(f'[ERROR] Stopped watching the constraints files for changes: {watcher.exception()!r}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-c', '--constraints', action='append', required=True,
+                        help='<domain>=<constraints file>, e.g. land=constraints-land.json (repeatable)')
+    parser.add_argument('--host', default='127.0.0.1', help='Host to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8642, help='Port to listen on')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='Number of answers kept in the LRU cache')
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_INTERVAL,
+                        help='Seconds between checks for changed constraints files')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    files = {}
+    for item in args.constraints:
+        domain, sep, fpath = item.partition('=')
+
+        if not sep:
+            raise Exception(f'Expected <domain>=<constraints file>, got: {item}')
+
+        files[domain] = fpath
+
+    service = ConstraintsService(files, cache_size=args.cache_size)
+
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+
+    main()
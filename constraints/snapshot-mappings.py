@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+"""
+Exports the code -> label mappings used by `mappers.py` from the `wfs_mappings`
+module (in the sibling "cdm-lens" checkout) to a local JSON snapshot.
+
+The snapshot holds a format version and a sha256 hash of its content, which
+is checked whenever it is loaded. When the snapshot exists, the constraints
+tools use it and do not import anything from "cdm-lens".
+
+Re-run this whenever `wfs_mappings` changes.
+"""
+
+import argparse
+
+import mappers
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-o', '--output-file', default=mappers.SNAPSHOT_FILE,
+                        help='Snapshot file to write')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    mappings = mappers.import_wfs_mappings()
+    mappers.write_snapshot(args.output_file, mappings)
+
+    for key, fields in mappings.items():
+        print(f'[INFO] {key}: {len(fields)} codes')
+
+    print(f'[INFO] Content hash: {mappers.content_hash(mappings)}')
+    print(f'[INFO] Wrote: {args.output_file}')
+
+
+if __name__ == '__main__':
+
+    main()
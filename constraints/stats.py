@@ -0,0 +1,124 @@
+"""
+Optional timing and counter instrumentation for the constraints tools.
+
+Instrumentation is off unless `enable()` is called. While it is off, `timed()`
+hands back a shared do-nothing context manager and `count()` returns at once,
+so the calls can stay in hot loops.
+
+When enabled, every `timed()` block writes one JSON line to the stats file:
+
+    {"event": "stage", "stage": "minimise", "seconds": 1.23, "peak_rss_kb": 51234, ...}
+
+along with any fields passed in or added to the yielded dictionary. `close()`
+writes a final "summary" line with the counters and the overall peak memory.
+"""
+
+import cProfile
+import json
+import resource
+import time
+
+
+ENABLED = False
+
+_writer = None
+_counters = {}
+_profiler = None
+
+
+class _Timer(object):
+
+    def __init__(self, stage, fields):
+        self.fields = dict(stage=stage, **fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.fields
+
+    def __exit__(self, *exc_info):
+        self.fields['seconds'] = round(time.perf_counter() - self.start, 6)
+        self.fields['peak_rss_kb'] = peak_rss_kb()
+
+        if exc_info[0]:
+            self.fields['error'] = repr(exc_info[1])
+
+        _write('stage', self.fields)
+        return False
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        # Fields set by the caller are thrown away
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _write(event, fields):
+    _writer.write(json.dumps(dict(event=event, **fields), default=str) + '\n')
+
+
+def enable(stats_file):
+    "Turns on instrumentation, writing JSON lines to `stats_file`."
+    global ENABLED, _writer
+    _writer = open(stats_file, 'w')
+    ENABLED = True
+
+
+def disable():
+    "Turns off instrumentation in this process (without writing a summary)."
+    global ENABLED
+    ENABLED = False
+
+
+def timed(stage, **fields):
+    "Returns a context manager that records the time taken by the block it wraps."
+    if not ENABLED:
+        return _NULL_TIMER
+
+    return _Timer(stage, fields)
+
+
+def count(name, n=1):
+    "Adds `n` to the counter `name`."
+    if ENABLED:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def close():
+    "Writes the summary line and closes the stats file."
+    global ENABLED, _writer
+
+    if not ENABLED:
+        return
+
+    _write('summary', {'counters': _counters, 'peak_rss_kb': peak_rss_kb()})
+    _writer.close()
+
+    _writer = None
+    ENABLED = False
+
+
+def start_profile():
+    global _profiler
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+
+def stop_profile(profile_file):
+    "Stops the profiler and writes its stats to `profile_file` (readable with `pstats`)."
+    global _profiler
+    _profiler.disable()
+    _profiler.dump_stats(profile_file)
+    _profiler = None
+
+    print(f'[INFO] Wrote profile: {profile_file}')
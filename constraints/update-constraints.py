@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+Updates an existing constraints file from a delta counts file, without
+minimising all the records again.
+
+The delta counts file has the same format as the full counts file. Rows with
+a count above zero are combinations to add, and rows with a zero count are
+combinations to remove:
+
+ - a removed combination is cut out of every constraint that covers it, by
+   splitting that constraint into (at most one per key) smaller constraints
+ - an added combination that is not yet covered becomes a new constraint
+
+The new and split constraints are then merged with any constraints that are
+identical to them apart from one key (see `merge.merge_touched`). Constraints
+that were not touched stay as they are, so the result is usually close to, but
+not always as small as, a full minimisation.
+
+Usage:
+
+    python3 update-constraints.py -i constraints.json -d delta-counts.land -o constraints-new.json
+"""
+
+import argparse
+
+import json_stream
+import mappers
+import merge
+import stats
+from record_matrix import intern_values, read_counts, value_lists
+
+
+def read_constraints(fpath):
+    "Reads the (mapped) constraints in `fpath` as {key: frozenset} dictionaries of codes."
+    with open(fpath) as reader:
+        return [dict([(key, intern_values(value)) for key, value in con.items()])
+                for con in mappers.unmap_constraints(json_stream.iter_json_array(reader))]
+
+
+def read_delta(fpath, delimiter=','):
+    """Reads the delta counts file `fpath`.
+
+    Returns:
+        tuple: (columns, added, removed) - lists of {key: value} dictionaries
+    """
+    _, records = read_counts(fpath, delimiter=delimiter)
+    columns = [key for key in records.columns if key != 'count']
+
+    added, removed = [], []
+
+    for row in records.codes.tolist():
+        point = dict([(key, records.tables[i][code])
+                      for i, (key, code) in enumerate(zip(records.columns, row))])
+
+        if int(point.pop('count')) > 0:
+            added.append(point)
+        else:
+            removed.append(point)
+
+    return columns, added, removed
+
+
+def update_constraints(constraints, columns, added, removed):
+    """Applies the `added` and `removed` combinations to `constraints`.
+
+    Returns:
+        list: the updated constraints
+    """
+    index = merge.CoverIndex(constraints, columns)
+    touched = []
+    n_split = n_skipped = 0
+
+    for point in removed:
+        for con_id in index.covering(point):
+            pieces = merge.subtract_point(index.remove(con_id), point, columns)
+
+            for piece in pieces:
+                index.add(piece)
+
+            touched.extend(pieces)
+            n_split += 1
+
+    for point in added:
+        if index.covering(point):
+            n_skipped += 1
+            continue
+
+        con = dict([(key, intern_values((point[key],))) for key in columns])
+        index.add(con)
+        touched.append(con)
+
+    print(f'[INFO] Removed {len(removed)} combinations (splitting {n_split} constraints), '
+          f'added {len(added) - n_skipped} ({n_skipped} were already covered)')
+    stats.count('constraints_split', n_split)
+
+    return merge.merge_touched(index.values(), touched, columns)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-i', '--input-file', required=True, help='Existing constraints (JSON)')
+    parser.add_argument('-d', '--delta-file', required=True,
+                        help='Delta counts file: rows to add (count > 0) and remove (count 0)')
+    parser.add_argument('-o', '--output-file', required=True, help='Output file')
+    parser.add_argument('--delimiter', default=',', required=False,
+                        help='Delimiter of the delta counts file')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    constraints = read_constraints(args.input_file)
+    columns, added, removed = read_delta(args.delta_file, delimiter=args.delimiter)
+
+    for con in constraints:
+        if sorted(con) != sorted(columns):
+            raise Exception(f'Constraint keys do not match the delta columns {columns}: {con}')
+
+    print(f'[INFO] Read {len(constraints)} constraints and {len(added) + len(removed)} delta records')
+    n_in = len(constraints)
+
+    constraints = update_constraints(constraints, columns, added, removed)
+    print(f'[INFO] Constraints: {n_in} -> {len(constraints)}')
+
+    with open(args.output_file, 'w') as writer:
+        json_stream.write_json_array(writer, mappers.map_constraints(value_lists(constraints)))
+
+    print(f'[INFO] Wrote: {args.output_file}')
+
+
+if __name__ == '__main__':
+
+    main()
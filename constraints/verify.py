@@ -0,0 +1,133 @@
+"""
+Exact coverage check for minimised constraints.
+
+The constraints must cover exactly the combinations of values found in the
+records: none may be lost and none invented. Both sides are encoded into the
+same integer key space: every combination of codes (one per column, see
+`record_matrix.py`) becomes a single mixed-radix `int64`. The record keys and
+the keys of every constraint's cross product are sorted and de-duplicated,
+and the two arrays must then be identical. Otherwise the first differences
+are decoded and reported.
+"""
+
+import numpy as np
+
+from record_matrix import distinct_sorted
+
+
+# Number of differences reported
+N_EXAMPLES = 5
+
+
+def _sizes(records):
+    sizes = [max(1, len(table)) for table in records.tables]
+
+    if np.prod(sizes, dtype=float) >= 2 ** 63:
+        raise Exception(f'Too many combinations of values to verify: {sizes}')
+
+    return sizes
+
+
+def record_keys(records):
+    "Returns the sorted, distinct keys of the combinations in `records`."
+    combined = np.zeros(len(records), dtype=np.int64)
+
+    for i, size in enumerate(_sizes(records)):
+        combined *= size
+        combined += records.codes[:, i]
+
+    return distinct_sorted(combined)
+
+
+def constraint_keys(records, constraints):
+    """Returns the sorted, distinct keys of the combinations covered by
+    `constraints` ({key: values} dictionaries), in the key space of `records`.
+
+    Returns:
+        tuple: (keys, unknown) - `unknown` lists (key, value) pairs found in the
+               constraints but not in the records
+    """
+    sizes = _sizes(records)
+    lookups = [dict([(value, code) for code, value in enumerate(table)])
+               for table in records.tables]
+
+    expected = set(records.columns)
+    arrays = []
+    unknown = []
+
+    for con in constraints:
+        if set(con) != expected:
+            raise Exception(f'Constraint keys do not match the record columns {records.columns}: {con}')
+
+        combined = np.zeros(1, dtype=np.int64)
+
+        for key, lookup, size in zip(records.columns, lookups, sizes):
+            codes = []
+
+            for value in con[key]:
+                if value in lookup:
+                    codes.append(lookup[value])
+                else:
+                    unknown.append((key, value))
+
+            combined = (combined[:, None] * size + np.array(codes, dtype=np.int64)[None, :]).ravel()
+
+        arrays.append(combined)
+
+    keys = distinct_sorted(np.concatenate(arrays)) if arrays else np.zeros(0, dtype=np.int64)
+    return keys, sorted(set(unknown))
+
+
+def decode_key(records, key):
+    "Returns the {column: value} combination for integer `key`."
+    values = {}
+
+    for i, size in reversed(list(enumerate(_sizes(records)))):
+        key, code = divmod(int(key), size)
+        values[records.columns[i]] = records.tables[i][code]
+
+    return dict([(column, values[column]) for column in records.columns])
+
+
+def coverage_differences(records, constraints, n_examples=N_EXAMPLES):
+    """Compares the combinations in `records` with those covered by `constraints`.
+
+    Returns:
+        dict: {"lost": [...], "invented": [...], "unknown": [...], "n_lost": int,
+               "n_invented": int} - the first `n_examples` of each difference
+    """
+    expected = record_keys(records)
+    found, unknown = constraint_keys(records, constraints)
+
+    if np.array_equal(expected, found) and not unknown:
+        return None
+
+    lost = np.setdiff1d(expected, found, assume_unique=True)
+    invented = np.setdiff1d(found, expected, assume_unique=True)
+
+    return {'lost': [decode_key(records, key) for key in lost[:n_examples]],
+            'invented': [decode_key(records, key) for key in invented[:n_examples]],
+            'unknown': unknown[:n_examples],
+            'n_lost': lost.size,
+            'n_invented': invented.size}
+
+
+def verify_coverage(records, constraints, n_examples=N_EXAMPLES):
+    """Raises an Exception, reporting the first differences, unless `constraints`
+    cover exactly the combinations in `records`.
+    """
+    diffs = coverage_differences(records, constraints, n_examples=n_examples)
+
+    if not diffs:
+        print(f'[INFO] Verified: {len(constraints)} constraints cover exactly the '
+              f'combinations in {len(records)} records')
+        return
+
+    lines = [f'Constraints do not cover the records exactly: {diffs["n_lost"]} combinations '
+             f'lost, {diffs["n_invented"]} invented']
+
+    lines.extend([f'  lost: {_}' for _ in diffs['lost']])
+    lines.extend([f'  invented: {_}' for _ in diffs['invented']])
+    lines.extend([f'  value not in records: {key}={value!r}' for key, value in diffs['unknown']])
+
+    raise Exception('\n'.join(lines))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks batch form rendering (`render.render_batch`), by rendering many
+copies of the form specs into a temporary directory.
+
+The forms are rendered serially, then over a pool of `--workers` processes,
+and the throughput of each is reported.
+
+Usage:
+
+    python render-benchmark.py -n 500 -w 8
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from render import SPECS, load_spec, render_batch
+
+
+def batch_specs(spec_files, n, out_dir, constraints_file=None):
+    "Returns `n` specs, cycling over `spec_files`, each writing its own file in `out_dir`."
+    specs = [load_spec(spec_file) for spec_file in spec_files]
+    batch = []
+
+    for i in range(n):
+        spec = dict(specs[i % len(specs)], out_file=os.path.join(out_dir, f"form-{i:05d}.html"))
+
+        if constraints_file:
+            spec["constraints_file"] = constraints_file
+
+        batch.append(spec)
+
+    return batch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--n-forms", type=int, default=500, help="Number of forms to render")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of processes for the parallel run")
+    parser.add_argument("-s", "--specs", nargs="+", default=SPECS, help="Form spec files (JSON)")
+    parser.add_argument("-c", "--constraints-file", required=False,
+                        help="Embed constraint masks from this constraints file in every form")
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+    out_dir = tempfile.mkdtemp(prefix="render-benchmark-")
+
+    try:
+        specs = batch_specs(args.specs, args.n_forms, out_dir, args.constraints_file)
+
+        for workers in sorted(set([1, args.workers])):
+            start = time.perf_counter()
+            render_batch(specs, workers=workers, quiet=True)
+            elapsed = time.perf_counter() - start
+
+            print(f"[INFO] {len(specs)} forms with {workers} worker(s) in {elapsed:.2f} s: "
+                  f"{len(specs) / elapsed:.0f} forms/s")
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+
+    main()
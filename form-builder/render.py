@@ -1,17 +1,98 @@
-def render_page(out_file, title, body, template="template.html"):
+import argparse
+import base64
+import functools
+import json
+import multiprocessing
+import string
 
+
+SPECS = ["specs/land.json", "specs/marine.json"]
+
+
+@functools.lru_cache()
+def load_template(template="template.html"):
+    """Reads and compiles `template` once (per process): a tuple of (text, field)
+    pieces, where field is None or the name of the field following the text.
+    """
     with open(template) as reader:
-        tmpl = reader.read()
+        parsed = list(string.Formatter().parse(reader.read()))
+
+    for text, field, spec, conversion in parsed:
+        if field is not None and (spec or conversion or not field.isidentifier()):
+            raise Exception(f"Unsupported template field in {template}: {{{field}}}")
+
+    return tuple([(text, field) for text, field, spec, conversion in parsed])
+
+
+def render_page(out_file, title, body, template="template.html", quiet=False):
+
+    fields = {"title": title, "body": body}
+    page = "".join([text + (fields[field] if field is not None else "")
+                    for text, field in load_template(template)])
 
     with open(out_file, "w") as writer:
-        writer.write(tmpl.format(title=title, body=body))
+        writer.write(page)
+
+    if not quiet:
+        print(f"Wrote: {out_file}")
+
+
+class ConstraintMasks(object):
+    """Bitmasks over a list of (mapped) constraints: the mask of a value has
+    bit `i` set if constraint `i` allows that value.
+
+    A form selection is valid if, ANDing across the sections the OR of the
+    masks of the options selected in each, any bit is left set.
+
+    Sections whose key is not in the constraints (e.g. "day" or "hour" when
+    the constraints do not have them) get no masks, and are left out of the
+    AND: they do not constrain the selection.
+    """
+
+    def __init__(self, constraints):
+        self.n_bytes = (len(constraints) + 7) // 8
+        self.keys = set()
+        positions = {}
+
+        for i, con in enumerate(constraints):
+            for key, values in con.items():
+                self.keys.add(key)
+
+                for value in values:
+                    positions.setdefault((key, value), []).append(i)
+
+        self.masks = {}
+
+        for key_value, indexes in positions.items():
+            buf = bytearray(self.n_bytes)
 
-    print(f"Wrote: {out_file}")
+            for i in indexes:
+                buf[i >> 3] |= 1 << (i & 7)
+
+            self.masks[key_value] = int.from_bytes(buf, "little")
+
+    @classmethod
+    def from_file(cls, constraints_file):
+        with open(constraints_file) as reader:
+            return cls(json.load(reader))
+
+    def encode(self, key, values):
+        """Returns the base64 mask of the constraints that allow any of `values`
+        (a value, or a list of values) for `key`.
+        """
+        if isinstance(values, str):
+            values = [values]
+
+        mask = 0
+        for value in values:
+            mask |= self.masks.get((key, value), 0)
+
+        return base64.b64encode(mask.to_bytes(self.n_bytes, "little")).decode("ascii")
 
 
 class Section(object):
     def __init__(self, title, note, tooltip, labels=None, n=1, select_all=False, default=None, widget=None,
-                 subsections=None):
+                 subsections=None, name=None, values=None):
         self.title = title
         self.note = note
         self.tooltip = tooltip
@@ -24,9 +105,14 @@ class Section(object):
         
         self.subsections = subsections
 
+        # Constraint key and values (one per label, or a list for a label
+        # covering several values), for embedding constraint masks
+        self.name = name
+        self.values = values
+
     def _common(self):
 
-        content = ""
+        parts = []
         ss = self.subsections
         
         if self.n == 1:
@@ -35,14 +121,14 @@ class Section(object):
             n_string = "at least 1 option"
             self.select_all = True
 
-        content += f' <div class="howmany">Please select: {n_string}</div>\n'
-        content += ' <div class="aselector">\n'
+        parts.append(f' <div class="howmany">Please select: {n_string}</div>\n')
+        parts.append(' <div class="aselector">\n')
 
         for count, label in enumerate(self.labels):
         
             if ss and count in ss:
                 value = ss[count]
-                content += f'  <div><img class="smallicon" src="arrow.png" /> <b>{value}</b></div>'
+                parts.append(f'  <div><img class="smallicon" src="arrow.png" /> <b>{value}</b></div>')
                 
             if self.default == label:
                 checked = "checked=checked"
@@ -60,46 +146,38 @@ class Section(object):
                 # Put on single lines if up to 4
                 newline = "<br />"
 
-            content += f'  <input type="checkbox" class="acheckbox" {checked}>{label}</input>{newline}\n'
+            parts.append(f'  <input type="checkbox" class="acheckbox" {checked}>{label}</input>{newline}\n')
 
-        content += " </div>\n"
+        parts.append(" </div>\n")
 
         if self.select_all:
-            content += ' <div class="aselectall"><a href="#">Select all</a>&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;<a href="#">Clear all</a></div>\n'
+            parts.append(' <div class="aselectall"><a href="#">Select all</a>&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;<a href="#">Clear all</a></div>\n')
         else:
-            content += ' <div class="aselectall"><a href="#">Clear</a></div>\n'
+            parts.append(' <div class="aselectall"><a href="#">Clear</a></div>\n')
 
-        return content
+        return "".join(parts)
 
     def _render_bbox(self):
-        content = ' <div class="howmany">Please select: a valid domain</div>\n'
-
-        content += (
-            ' <div class="padmid"><input type="text" size="7" value="90.0" /> N</div>'
-        )
-        content += " <div>\n"
-        content += '   <span class="padleft"><input type="text" size="7" value="-180.0" /> W</span>\n'
-        content += '   <span class="padright"><input type="text" size="7" value="180.0" /> E</span>\n'
-        content += " </div>\n"
-        content += (
-            ' <div class="padmid"><input type="text" size="7" value="-90.0" /> S</div>'
-        )
-
-        content += ' <div class="aselectall"><a href="#">Reset bounding box</a></div>\n'
-
-        return content
+        return "".join([
+            ' <div class="howmany">Please select: a valid domain</div>\n',
+            ' <div class="padmid"><input type="text" size="7" value="90.0" /> N</div>',
+            " <div>\n",
+            '   <span class="padleft"><input type="text" size="7" value="-180.0" /> W</span>\n',
+            '   <span class="padright"><input type="text" size="7" value="180.0" /> E</span>\n',
+            " </div>\n",
+            ' <div class="padmid"><input type="text" size="7" value="-90.0" /> S</div>',
+            ' <div class="aselectall"><a href="#">Reset bounding box</a></div>\n',
+        ])
 
     def _render_location(self):
-        content = ' <div class="howmany">Please select: a valid location</div>\n'
-
-        content += " <div>\n"
-        content += '   <span class="padleft"><input type="text" size="7" value="0.0" /> N</span>\n'
-        content += '   <span class="padmid"><input type="text" size="7" value="0.0" /> E</span>\n'
-        content += " </div>"
-
-        content += ' <div class="aselectall"><a href="#">Reset location</a></div>\n'
-
-        return content
+        return "".join([
+            ' <div class="howmany">Please select: a valid location</div>\n',
+            " <div>\n",
+            '   <span class="padleft"><input type="text" size="7" value="0.0" /> N</span>\n',
+            '   <span class="padmid"><input type="text" size="7" value="0.0" /> E</span>\n',
+            " </div>",
+            ' <div class="aselectall"><a href="#">Reset location</a></div>\n',
+        ])
 
     def _render_widget(self):
         if self.widget == "bbox":
@@ -107,22 +185,31 @@ class Section(object):
         elif self.widget == "location":
             return self._render_location()
 
-    def render(self):
-        body = '<div class="abox">\n'
-        body += f' <div class="atitle">{self.title} <span title="{self.tooltip}">'
-        body += f'<img class="smallicon" src="tooltip_icon.png" /></span>'
-        body += f'<span class="smalltext">{self.tooltip}</span></div>\n'
+    def _render_masks(self, masks):
+        "Returns the attributes holding the constraint mask of each option, in checkbox order."
+        encoded = [masks.encode(self.name, values) for values in self.values]
+        return f' data-constraint="{self.name}" data-masks="{",".join(encoded)}"'
+
+    def render(self, masks=None):
+        if masks and self.name in masks.keys and self.values:
+            parts = [f'<div class="abox"{self._render_masks(masks)}>\n']
+        else:
+            parts = ['<div class="abox">\n']
+
+        parts.append(f' <div class="atitle">{self.title} <span title="{self.tooltip}">')
+        parts.append(f'<img class="smallicon" src="tooltip_icon.png" /></span>')
+        parts.append(f'<span class="smalltext">{self.tooltip}</span></div>\n')
 
-        body += f' <div class="note">{self.note}</div>\n'
+        parts.append(f' <div class="note">{self.note}</div>\n')
 
         if self.widget:
-            body += self._render_widget()
+            parts.append(self._render_widget())
         else:
-            body += self._common()
+            parts.append(self._common())
 
-        body += "</div>\n"
+        parts.append("</div>\n")
 
-        return body
+        return "".join(parts)
 
 
 def format_strings(l):
@@ -140,366 +227,145 @@ def format_strings(l):
     return n
 
 
-def main():
+def year_values(option):
+    "Returns the years for a year option: one year, or a range such as '1761-1790'."
+    if "-" not in option:
+        return option
+
+    start, end = option.split("-")
+    return [str(year) for year in range(int(start), int(end) + 1)]
+
+
+def expand_items(items):
+    """Expands the option (or value) list of a section spec: each item is a string,
+    or a {"range": [first, last], "format": "02d"} dictionary standing for the
+    (formatted) integers from first to last.
+    """
+    expanded = []
+
+    for item in items:
+        if isinstance(item, dict):
+            first, last = item["range"]
+            expanded.extend([format(i, item.get("format", "")) for i in range(first, last + 1)])
+        else:
+            expanded.append(item)
+
+    return expanded
+
+
+def build_section(spec):
+    """Returns the Section described by a section spec.
+
+    Args:
+        spec (dict): a section of a form spec (see `specs/land.json`). "values" is
+            a list, "options" (the options are the values) or "years" (see `year_values`)
+    """
+    options = expand_items(spec.get("options", []))
+    labels = format_strings(options) if options else None
+
+    values = spec.get("values")
+    if values == "options":
+        values = options
+    elif values == "years":
+        values = [year_values(option) for option in options]
+    elif values:
+        values = expand_items(values)
+
+    default = labels[spec["default_index"]] if "default_index" in spec else None
+    subsections = dict([(int(count), text) for count, text in spec.get("subsections", {}).items()])
 
-    mockup_land()
-    mockup_marine()
+    return Section(spec["title"], spec["note"], spec["tooltip"], labels, n=spec.get("n", 1),
+                   default=default, widget=spec.get("widget"), subsections=subsections or None,
+                   name=spec.get("name"), values=values)
 
 
-def mockup_land():
-    body = ""
-    title = (
-        "Download data: Surface land meteorological station holdings"
-    )
+def load_spec(spec_file):
+    with open(spec_file) as reader:
+        return json.load(reader)
 
-    # Time frequency
-    options = ["Monthly", "Daily", "Sub-daily"]
-    labels = format_strings(options)
-    section = Section(
-        "Time frequency",
-        "The time-step or frequency of observations",
-        "Selecting this will constrain the time selections shown below",
-        labels,
-    )
-    body += section.render()
 
+@functools.lru_cache()
+def load_masks(constraints_file):
+    "Returns the ConstraintMasks for `constraints_file`, read once per process."
+    return ConstraintMasks.from_file(constraints_file)
+
+
+def render_spec(spec, template="template.html", quiet=False):
+    """Renders the form described by `spec` to its "out_file".
+
+    Args:
+        spec (dict): form spec: "title", "out_file", "sections" and, optionally,
+            "constraints_file" to embed constraint masks from
+        template (str): page template
+        quiet (bool): do not report the file written
+
+    Returns:
+        str: the file written
     """
-    # Query type
-    options = [
-        "Single location query (over time series)",
-        "Bounding box query (limited times)",
-    ]
-    labels = format_strings(options)
-    section = Section(
-        "Query type",
-        "Defines which constraints spatial and temporal constraints will be applied to the query",
-        "Selecting this will constrain the spatial and temporal selections below",
-        labels,
-    )
-    body += section.render()
-"""
-
-    # Bounding Box
-    section = Section(
-        "Bounding box",
-        "Defines a spatial domain in which to select data. "
-        "Selecting a large area will reduce the available time range that you can select. ",
-        "Selecting some areas of the globe will generate an empty result set",
-        widget="bbox",
-    )
-    body += section.render()
-
-    """# Location
-    section = Section(
-        "Location",
-        "Defines a single location for which to select data. "
-        "ONLY AVAILABLE IF Query Type is a Location.",
-        "Select a location and the tool will find the nearest 5 stations/observation sets for time series selected",
-        widget="location",
-    )
-    body += section.render()
-"""
-
-    # Variable
-    options = """
-Monthly maximum air temperature [K]
-Monthly minimum air temperature [K]
-Monthly mean air temperature [K]
-Daily maximum air temperature [K]
-Daily minimum air temperature [K]
-Daily mean air temperature [K]
-Daily Dew point temperature [K]
-Daily Accumulated precipitation [mm]
-Daily Fresh snow [mm]
-Daily Snow depth [cm]
-Daily Snow water equivalent [mm]
-Daily Surface air pressure at sea level [Pa]
-Daily Surface air pressure at specified height [Pa]
-Daily Wind speed [m s-1]
-Sub-daily Air temperature [K]
-Sub-daily Dew point temperature [K]
-Sub-daily Dew point temperature [K]
-Sub-daily Fresh snow [mm]
-Sub-daily Snow depth [cm]
-Sub-daily Snow water equivalent [mm]
-Sub-daily Surface air pressure at sea level [Pa]
-Sub-daily Surface air pressure at specified height [Pa]
-Sub-daily Wind speed [m s-1]
-Sub-daily wind from direction [degree]
-""".strip().split('\n')
-
-    labels = format_strings(options)
-    subsections = {0: 'Monthly variables - available if time frequency is: <b>Monthly</b>', 
-                   3: 'Daily variables - available if time frequency is: <b>Daily</b>', 
-                   14: 'Sub-daily variables - available if time frequency is: <b>Sub-daily</b>'}
-    
-    note = "NOTE: The outputs will only include variables found within the domain specified in the request."    
-    section = Section(
-        "Variable",
-        "Select one or more of the available variables of interest",
-        "You can select as many variables as you like",
-        labels,
-        n="+", subsections=subsections
-    )
-    body += section.render()
-
-    # Year
-    options = ['1761-1790', '1791-1820', '1821-1850', '1851-1880', '1881-1910']
-    options += [str(year) for year in range(1911, 2019)]
-    labels = format_strings(options)
-    section = Section(
-        "Year",
-        "Historical data can be selected in larger chunks because "
-        "more data will be available in recent years.",
-        "Select one or more options",
-        labels,
-        n="+",
-    )
-    body += section.render()
-
-    # Month
-    options = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
-    labels = format_strings(options)
-    section = Section(
-        "Month", "Months that you require", "Months required", labels, n="+"
-    )
-    body += section.render()
-
-    # Day
-    options = [f"{day:02d}" for day in range(1, 32)]
-    labels = format_strings(options)
-    section = Section(
-        "Day",
-        "Days that you require",
-        "This selection is ONLY AVAILABLE for &quot;Daily&quot; and &quot;Sub-daily&quot; time-steps.",
-        labels,
-        n="+",
-    )
-    body += section.render()
-
-    # Intended use
-    labels = format_strings(["Non-commercial", "Commercial"])
-    section = Section(
-        "Intended use",
-        "How you intend to use the data",
-        "Selecting this will reduce the number of observations available, due to usage restrictions",
-        labels,
-        default="Non-commercial",
-    )
-    body += section.render()
-
-    # Data Quality
-    options = ["Quality controlled", "All data"]
-    labels = format_strings(options)
-    section = Section(
-        "Data Quality",
-        "Quality control level required",
-        "Selecting &quot;Quality controlled&quot; will only return observations that have passed a certain level of QC (e.g. World Weather Record checks).",
-        labels,
-        default="Quality controlled",
-    )
-    body += section.render()
-
-    # Partial record options
-    default = "Only download records where all chosen variables are available"
-    options = [
-        default,
-        "Download all records where one or more of the chosen varaibles is available",
-    ]
-    labels = format_strings(options)
-    text = "Decide whether to receive records at time steps when all your chosen variables are not available"
-    section = Section(
-        "Select full or partial records",
-        text,
-        text,
-        labels,
-        default=labels[0]
-    )
-    body += section.render()
-
-    # Format
-    options = ["CSV (zipped)", "JSON (zipped)"]
-    labels = format_strings(options)
-    section = Section(
-        "Format",
-        "Data format",
-        "Zipped outputs will be smaller in volume, they may contain multiple data files.",
-        labels,
-        default=labels[0],
-    )
-    body += section.render()
-
-    render_page("land-mockup.html", title, body)
-
-
-def mockup_marine():
-    body = ""
-    title = "Download data: In situ sub-daily surface marine observations from 1946"
-
-    """# Query type
-    options = [
-        "Small location query (over time series)",
-        "Bounding box query (limited times)",
-    ]
-    labels = format_strings(options)
-    section = Section(
-        "Query type",
-        "Defines which constraints spatial and temporal constraints will be applied to the query",
-        "Selecting this will constrain the spatial and temporal selections below",
-        labels,
-    )
-    body += section.render()
-"""
-    # Bounding Box
-    section = Section(
-        "Bounding box",
-        "Defines a spatial domain in which to select data. "
-        "Selecting a large area will reduce the available time range that you can select. ",
-        "Selecting some areas of the globe will generate an empty result set",
-        widget="bbox",
-    )
-    body += section.render()
-
-    """# Location
-    section = Section(
-        "Location",
-        "Defines the centre of a 1&deg; x 1&deg; polygon in which to search for marinedata. "
-        "ONLY AVAILABLE IF Query Type is a Location.",
-        "Select a location and the tool will find all observations within the 1&deg; x 1&deg; polygon around that point for time series selected",
-        widget="location",
-    )
-    body += section.render()
-"""
-    # Variable
-    options = [
-        "Air temperature [K]",
-        "Wet bulb temperature [K]",
-        "Water temperature (sea surface temperature) [K]",
-        "Air pressure [Pa]",
-        "Air pressure at sea level [Pa]",
-        "Wind from direction [degrees true]",
-        "Wind speed [m s^-1]",
-    ]
-    labels = format_strings(options)
-    note = "NOTE: The outputs will only include variables found within the domain specified in the request."
-    section = Section(
-        "Variable",
-        "Select one or more of the available variables of interest",
-        "You can select as many variables as you like",
-        labels,
-        n="+",
-    )
-    body += section.render()
-
-    """# Station type
-    options = ["Sea stations"]
-    labels = format_strings(options)
-    section = Section(
-        "Station type",
-        "The type of station recording the observation",
-        "Select the option",
-        labels,
-        default=labels[0],
-    )
-    body += section.render()
-"""
-    # Platform type
-    options = ["Ship", "Drifting buoy"]
-    labels = format_strings(options)
-    section = Section(
-        "Platform type",
-        "The type of platform from which the measurements were made",
-        "Select one or more options",
-        labels,
-        n="+",
-    )
-    body += section.render()
-
-    # Year
-    options = [str(year) for year in range(1946, 2019)]
-    labels = format_strings(options)
-    section = Section(
-        "Year",
-        "More data will be available in recent years.",
-        "Select one or more options",
-        labels,
-        n="+",
-    )
-    body += section.render()
-
-    # Month
-    options = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
-    labels = format_strings(options)
-    section = Section(
-        "Month", "Months that you require", "Months required", labels, n="+"
-    )
-    body += section.render()
-
-    # Day
-    options = [f"{day:02d}" for day in range(1, 32)]
-    labels = format_strings(options)
-    section = Section("Day", "Days that you require", "Days required", labels, n="+")
-    body += section.render()
-
-    # Hour
-    options = [f"{day:02d}" for day in range(24)]
-    labels = format_strings(options)
-    section = Section("Hour", "Hours that you require", "Hours required", labels, n="+")
-    body += section.render()
-
-    """# Intended use
-    labels = format_strings(["Non-commercial", "Commercial"])
-    section = Section(
-        "Intended use",
-        "How you intend to use the data",
-        "Selecting this will reduce the number of observations available, due to usage restrictions",
-        labels,
-        default=labels[0],
-    )
-    body += section.render()
-"""
-    # Data Quality
-    options = ["Quality controlled", "All data"]
-    labels = format_strings(options)
-    section = Section(
-        "Data Quality",
-        "Quality control level required",
-        "Selecting &quot;Quality controlled&quot; will only return observations that have passed a certain level of QC (e.g. World Weather Record checks).",
-        labels,
-        default=labels[0],
-    )
-    body += section.render()
-
-    # Partial record options
-    default = "Only download records where all chosen variables are available"
-    options = [
-        default,
-        "Download all records where one or more of the chosen varaibles is available",
-    ]
-    labels = format_strings(options)
-    text = "Decide whether to receive records at time steps when all your chosen variables are not available"
-    section = Section(
-        "Select full or partial records",
-        text,
-        text,
-        labels,
-        default=labels[0]
-    )
-    body += section.render()
-
-    # Format
-    options = ["CSV (zipped)", "JSON (zipped)"]
-    labels = format_strings(options)
-    section = Section(
-        "Format",
-        "Data format",
-        "Zipped outputs will be smaller in volume, they may contain multiple data files.",
-        labels,
-        default=labels[0],
-    )
-    body += section.render()
-
-    render_page("marine-mockup.html", title, body)
+    masks = load_masks(spec["constraints_file"]) if spec.get("constraints_file") else None
+
+    body = "".join([build_section(section).render(masks)
+                    for section in spec["sections"] if section.get("enabled", True)])
+
+    render_page(spec["out_file"], spec["title"], body, template, quiet=quiet)
+    return spec["out_file"]
+
+
+def render_batch(specs, workers=1, template="template.html", quiet=False):
+    """Renders many form specs, over a pool of `workers` processes if more than one.
+
+    Each process reads the template (and any constraints file) once.
+
+    Returns:
+        list: the files written
+    """
+    render = functools.partial(render_spec, template=template, quiet=quiet)
+
+    if workers <= 1:
+        return [render(spec) for spec in specs]
+
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(render, specs, chunksize=max(1, len(specs) // (workers * 4)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-s", "--specs", nargs="+", default=SPECS,
+                        help="Form spec files (JSON) to render")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of processes to render the forms with")
+    parser.add_argument("--land-constraints", required=False,
+                        help="Embed constraint masks from this constraints file in the land form")
+    parser.add_argument("--marine-constraints", required=False,
+                        help="Embed constraint masks from this constraints file in the marine form")
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+    constraints = {"land": args.land_constraints, "marine": args.marine_constraints}
+
+    specs = []
+    for spec_file in args.specs:
+        spec = load_spec(spec_file)
+
+        if constraints.get(spec.get("domain")):
+            spec["constraints_file"] = constraints[spec["domain"]]
+
+        specs.append(spec)
+
+    render_batch(specs, workers=args.workers)
+
+
+def mockup_land(constraints_file=None):
+    render_spec(dict(load_spec(SPECS[0]), constraints_file=constraints_file))
+
+
+def mockup_marine(constraints_file=None):
+    render_spec(dict(load_spec(SPECS[1]), constraints_file=constraints_file))
 
 
 if __name__ == "__main__":